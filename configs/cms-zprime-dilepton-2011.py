@@ -86,6 +86,9 @@ import FitnessFunctions
 NeatNumberGenerations = 40 
 NeatNumberTries = 10
 NeatFitnessFunction = FitnessFunctions.EventEuclideanDistance()
+NeatFitnessProcesses = 1  # worker processes evaluating the fitness
+NeatFitnessBlockSize = 20 # chromosomes evaluated together by a worker
+NeatSinglePrecision = False # samples and networks in single precision
 
 # Discriminator information
 
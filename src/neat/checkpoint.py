@@ -0,0 +1,475 @@
+# Binary checkpoints: the chromosomes are packed in arrays of genes and
+# the rest of the population state is pickled in a small header.
+#
+# Layout: MAGIC, version and header size (struct HEADER), the header (a
+# pickled dict) and the raw arrays listed in header['arrays']. In the
+# pickled state the chromosomes are replaced by their index in the packed
+# tables (persistent ids); delta checkpoints only pack the chromosomes and
+# genes that are not in their (full) base checkpoint and refer to the others
+# by their index in the base (as -1-index).
+import array
+import cPickle as pickle
+from cStringIO import StringIO
+import gc
+import itertools
+import os
+import struct
+import sys
+import threading
+import chromosome
+
+MAGIC = 'NEATCKPT'
+VERSION = 1
+HEADER = '<8sIQ'
+
+# packed tables: (name, typecode)
+NODE_ARRAYS = (('node_id', 'i'), ('node_type', 'b'), ('node_activation', 'b'), ('node_class', 'b'),
+               ('node_bias', 'd'), ('node_response', 'd'), ('node_time_constant', 'd'))
+CONN_ARRAYS = (('conn_in', 'i'), ('conn_out', 'i'), ('conn_innov', 'i'), ('conn_enabled', 'b'),
+               ('conn_class', 'b'), ('conn_weight', 'd'))
+CHROMO_ARRAYS = (('chromo_fields', 'i'), ('chromo_fitness', 'd'),
+                 ('chromo_nodes', 'i'), ('chromo_conns', 'i'), ('chromo_order', 'i'))
+ARRAYS = NODE_ARRAYS + CONN_ARRAYS + CHROMO_ARRAYS
+
+NODE_TYPES = ('INPUT', 'HIDDEN', 'OUTPUT')
+# chromo_fields per chromosome: id, parents ids, species id (-1 for None),
+# inputs, outputs, number of nodes, links and ordered (hidden) nodes and
+# the index of its class and of its gene classes
+FIELDS = 12
+# chromosome attributes held in the packed tables
+PACKED = frozenset(('_id', 'parent1_id', 'parent2_id', 'species_id', 'fitness',
+                    '_input_nodes', '_output_nodes', '_node_gene_type', '_conn_gene_type',
+                    '_node_genes', '_connection_genes', '_FFChromosome__node_order',
+                    '_compact_genes'))
+
+def is_checkpoint(filename):
+    """ Tells whether the file is a binary checkpoint """
+    f = open(filename, 'rb')
+    try:
+        return f.read(len(MAGIC)) == MAGIC
+    finally:
+        f.close()
+
+def _number(value):
+    return -1 if value is None else value
+
+def _value(number):
+    return None if number == -1 else number
+
+
+class _Tables(object):
+    """ Packs chromosomes (sharing their genes as they do in memory). Genes
+        of the base tables are referred to by their index there. The gene
+        tables are filled by pack(), once all the chromosomes are added.
+    """
+    def __init__(self, base=None):
+        self.arrays = dict((name, array.array(code)) for name, code in ARRAYS)
+        self.classes = []     # chromosome and gene classes
+        self.activations = [] # activation types
+        self.extras = {}      # chromosome index: attributes not packed
+        self.count = 0
+        self.indexes = {}     # id of a packed gene: index
+        self.node_genes = []  # packed genes (kept alive, their ids are keys)
+        self.conn_genes = []
+        self.__base = base and base.indexes or {}
+
+    def __index(self, table, item):
+        try:
+            return table.index(item)
+        except ValueError:
+            table.append(item)
+            return len(table) - 1
+
+    def __genes(self, genes, packed):
+        """ Returns the indexes of the genes, adding the new ones to packed """
+        indexes = self.indexes
+        base = self.__base
+        result = []
+        for g in genes:
+            key = id(g)
+            if key in indexes:
+                result.append(indexes[key])
+            elif key in base:
+                result.append(-1-base[key])
+            else:
+                indexes[key] = len(packed)
+                result.append(len(packed))
+                packed.append(g)
+        return result
+
+    def add(self, c):
+        """ Packs the chromosome c and returns its index """
+        a = self.arrays
+        order = getattr(c, '_FFChromosome__node_order', None)
+        nodes = self.__genes(c._node_genes, self.node_genes)
+        # in key order: chromosomes keep their link dicts filled in key order
+        # (see Chromosome._sort_connection_genes), so the loaded ones iterate alike
+        links = c._connection_genes
+        conns = self.__genes([links[key] for key in sorted(links)], self.conn_genes)
+        a['chromo_nodes'].fromlist(nodes)
+        a['chromo_conns'].fromlist(conns)
+        if order is not None:
+            a['chromo_order'].fromlist(order)
+        a['chromo_fields'].fromlist([c._id, _number(c.parent1_id), _number(c.parent2_id),
+                                     _number(c.species_id), c._input_nodes, c._output_nodes,
+                                     len(nodes), len(conns), -1 if order is None else len(order),
+                                     self.__index(self.classes, c.__class__),
+                                     self.__index(self.classes, c._node_gene_type),
+                                     self.__index(self.classes, c._conn_gene_type)])
+        # nan stands for the fitness of the chromosomes not evaluated
+        a['chromo_fitness'].append(float('nan') if c.fitness is None else c.fitness)
+        extra = dict((k, v) for k, v in c.__dict__.iteritems() if k not in PACKED)
+        if extra:
+            self.extras[self.count] = extra
+        self.count += 1
+        return self.count - 1
+
+    def __classes(self, genes):
+        classes = dict((cls, self.__index(self.classes, cls))
+                       for cls in set(g.__class__ for g in genes))
+        return [classes[g.__class__] for g in genes]
+
+    def pack(self):
+        """ Fills the gene tables (column by column) """
+        a = self.arrays
+        if self.node_genes:
+            signatures = [ng.signature() for ng in self.node_genes]
+            a['node_id'].fromlist([s[0] for s in signatures])
+            a['node_type'].fromlist([NODE_TYPES.index(s[1]) for s in signatures])
+            a['node_bias'].fromlist([s[2] for s in signatures])
+            a['node_response'].fromlist([s[3] for s in signatures])
+            activations = dict((t, self.__index(self.activations, t))
+                               for t in set(s[4] for s in signatures))
+            a['node_activation'].fromlist([activations[s[4]] for s in signatures])
+            a['node_time_constant'].fromlist([len(s) > 5 and s[5] or 0. for s in signatures])
+            a['node_class'].fromlist(self.__classes(self.node_genes))
+        if self.conn_genes:
+            # in, out, weight and enabled
+            signatures = [cg.signature() for cg in self.conn_genes]
+            a['conn_in'].fromlist([s[0] for s in signatures])
+            a['conn_out'].fromlist([s[1] for s in signatures])
+            a['conn_weight'].fromlist([s[2] for s in signatures])
+            a['conn_enabled'].fromlist([int(s[3]) for s in signatures])
+            a['conn_innov'].fromlist([cg.innovation for cg in self.conn_genes])
+            a['conn_class'].fromlist(self.__classes(self.conn_genes))
+
+
+def _genes(arrays, classes, activations):
+    """ Unpacks the node and connection genes of the tables """
+    timed = ['_time_constant' in getattr(cls, '_fields', ())
+             for cls in classes]
+    nodes = []
+    for fields in itertools.izip(arrays['node_class'], arrays['node_id'], arrays['node_type'],
+                                 arrays['node_bias'], arrays['node_response'],
+                                 arrays['node_activation'], arrays['node_time_constant']):
+        k, id, type, bias, response, activation, time_constant = fields
+        if timed[k]:
+            nodes.append(classes[k](id, NODE_TYPES[type], bias, response,
+                                    activations[activation], time_constant))
+        else:
+            nodes.append(classes[k](id, NODE_TYPES[type], bias, response, activations[activation]))
+    conns = [classes[k](i, o, w, bool(e), n) for k, i, o, w, e, n in
+             itertools.izip(arrays['conn_class'], arrays['conn_in'], arrays['conn_out'],
+                            arrays['conn_weight'], arrays['conn_enabled'], arrays['conn_innov'])]
+    return nodes, conns
+
+def _chromosomes(arrays, nodes, conns, classes, extras):
+    """ Unpacks the chromosomes of the tables. Negative gene indexes
+        (base genes) count from the end of nodes and conns.
+    """
+    chromosomes = []
+    fields = arrays['chromo_fields']
+    node_index = arrays['chromo_nodes']
+    conn_index = arrays['chromo_conns']
+    order = arrays['chromo_order']
+    n = c = o = 0
+    for i, fitness in enumerate(arrays['chromo_fitness']):
+        (id, parent1, parent2, species_id, inputs, outputs, num_nodes, num_conns,
+         num_order, cls, node_type, conn_type) = fields[i*FIELDS:(i+1)*FIELDS]
+        cls = classes[cls]
+        chromo = cls.__new__(cls)
+        state = chromo.__dict__
+        state.update(extras.get(i, ()))
+        state['_id'] = id
+        state['parent1_id'] = _value(parent1)
+        state['parent2_id'] = _value(parent2)
+        state['species_id'] = _value(species_id)
+        state['fitness'] = None if fitness != fitness else fitness
+        state['_input_nodes'] = inputs
+        state['_output_nodes'] = outputs
+        state['_node_gene_type'] = classes[node_type]
+        state['_conn_gene_type'] = classes[conn_type]
+        state['_node_genes'] = [nodes[j] for j in node_index[n:n+num_nodes]]
+        links = [conns[j] for j in conn_index[c:c+num_conns]]
+        state['_connection_genes'] = dict((cg.key, cg) for cg in links)
+        if num_order >= 0:
+            state['_FFChromosome__node_order'] = order[o:o+num_order].tolist()
+            o += num_order
+        n += num_nodes
+        c += num_conns
+        chromosomes.append(chromo)
+    return chromosomes
+
+
+def _read(filename):
+    """ Returns the header and the packed arrays of a checkpoint """
+    f = open(filename, 'rb')
+    try:
+        data = f.read()
+    finally:
+        f.close()
+    magic, version, size = struct.unpack_from(HEADER, data)
+    if magic != MAGIC:
+        raise IOError('%s is not a binary checkpoint' % filename)
+    if version > VERSION:
+        raise IOError('%s: unknown checkpoint version %d' % (filename, version))
+    offset = struct.calcsize(HEADER)
+    # the state (with its chromosomes) is unpickled later
+    header = pickle.loads(data[offset:offset+size])
+    offset += size
+    arrays = {}
+    for name, code, length in header['arrays']:
+        a = array.array(code)
+        end = offset + length*a.itemsize
+        a.fromstring(buffer(data, offset, end - offset)) # no intermediate copy
+        if header['byteorder'] != sys.byteorder:
+            a.byteswap()
+        arrays[name] = a
+        offset = end
+    return header, arrays
+
+def _unpickle(header, chromosomes, base):
+    def persistent_load(index):
+        index = int(index)
+        return chromosomes[index] if index >= 0 else base[-1-index]
+    unpickler = pickle.Unpickler(StringIO(header['state']))
+    unpickler.persistent_load = persistent_load
+    return unpickler.load()
+
+def load(filename):
+    """ Loads a (full or delta) binary checkpoint. Returns the saved state
+        and random state.
+    """
+    # lots of objects and no garbage: the collector would only slow it down
+    collecting = gc.isenabled()
+    gc.disable()
+    try:
+        return _load(filename)
+    finally:
+        if collecting:
+            gc.enable()
+
+def _load(filename):
+    header, arrays = _read(filename)
+    nodes, conns = _genes(arrays, header['classes'], header['activations'])
+    base = []
+    if header['base'] is not None:
+        # chromosomes and genes of the full checkpoint the delta is based on
+        base_file = os.path.join(os.path.dirname(filename), header['base'])
+        base_header, base_arrays = _read(base_file)
+        base_nodes, base_conns = _genes(base_arrays, base_header['classes'],
+                                        base_header['activations'])
+        base = _chromosomes(base_arrays, base_nodes, base_conns,
+                            base_header['classes'], base_header['extras'])
+        # base gene -1-i is found at index -1-i
+        nodes.extend(reversed(base_nodes))
+        conns.extend(reversed(base_conns))
+    chromosomes = _chromosomes(arrays, nodes, conns, header['classes'], header['extras'])
+    return _unpickle(header, chromosomes, base), header['random']
+
+
+class Writer(object):
+    """ Writes the checkpoints of a population: after a full checkpoint,
+        the given number of deltas (of that full checkpoint) are written
+        before the next full one. A checkpoint can be written by a
+        background thread (one at a time), the state being the one at the
+        call. Files are written aside and renamed when complete.
+    """
+    def __init__(self):
+        self.__base = None  # name of the last full checkpoint
+        self.__memo = {}    # id of its chromosomes: (index, chromosome, fingerprint)
+        self.__tables = None # and its packed tables (genes)
+        self.__deltas = 0   # deltas written since
+        self.__thread = None # writing in background
+        self.__error = None  # of the background writing (exc_info)
+
+    @staticmethod
+    def __fingerprint(c):
+        # genes are never changed in place (mutations copy them), so their
+        # identity tells whether a chromosome changed
+        return (c.fitness, c.species_id, c.parent1_id, c.parent2_id,
+                tuple(getattr(c, '_FFChromosome__node_order', ())),
+                map(id, c._node_genes), frozenset(map(id, c._connection_genes.itervalues())))
+
+    @staticmethod
+    def __freeze(c):
+        """ Returns a copy of c with its current genes (shared, not copied) """
+        frozen = c.__class__.__new__(c.__class__)
+        frozen.__dict__.update(c.__dict__)
+        frozen._node_genes = c._node_genes[:]
+        frozen._connection_genes = c._connection_genes.copy()
+        if hasattr(c, '_FFChromosome__node_order'):
+            frozen._FFChromosome__node_order = c._FFChromosome__node_order[:]
+        return frozen
+
+    def __unchanged(self, c):
+        try:
+            index, chromo, fingerprint = self.__memo[id(c)]
+        except KeyError:
+            return None
+        if fingerprint == self.__fingerprint(c) and not c.__dict__.viewkeys() - PACKED:
+            return index
+        return None
+
+    def write(self, filename, state, rstate, deltas=0, background=False):
+        """ Saves state (a dict holding chromosomes) and the random state
+            rstate, as a delta if deltas are due. In background only the
+            pickling of the state and a copy of the chromosomes are done
+            before returning.
+        """
+        self.wait()
+        delta = self.__base is not None and self.__deltas < deltas
+        base = delta and os.path.basename(self.__base) or None
+        base_tables = delta and self.__tables or None
+        memo = {}
+        chromosomes = [] # to be packed (in index order)
+        def persistent_id(obj):
+            if not isinstance(obj, chromosome.Chromosome):
+                return None
+            try:
+                return memo[id(obj)][0]
+            except KeyError:
+                index = self.__unchanged(obj) if delta else None
+                if index is None:
+                    index = len(chromosomes)
+                    chromosomes.append(background and self.__freeze(obj) or obj)
+                else:
+                    index = -1-index
+                memo[id(obj)] = (index, obj)
+                return index
+
+        data = StringIO()
+        pickler = pickle.Pickler(data, 2)
+        pickler.persistent_id = persistent_id
+        pickler.dump(state)
+
+        if delta:
+            self.__deltas += 1
+        else:
+            self.__base = filename
+            self.__tables = None # set once written
+            self.__memo = {}
+            self.__deltas = 0
+
+        job = (filename, data.getvalue(), rstate, base, chromosomes, base_tables, memo)
+        if background:
+            self.__thread = threading.Thread(target=self.__run, args=job)
+            self.__thread.start()
+        else:
+            self.__save(*job)
+
+    def wait(self):
+        """ Waits for the checkpoint written in background (raises its errors) """
+        if self.__thread is not None:
+            self.__thread.join()
+            self.__thread = None
+        error, self.__error = self.__error, None
+        if error is not None:
+            raise error[0], error[1], error[2]
+
+    def __run(self, *job):
+        try:
+            self.__save(*job)
+        except:
+            self.__error = sys.exc_info()
+
+    def __save(self, filename, state, rstate, base, chromosomes, base_tables, memo):
+        try:
+            tables = _Tables(base_tables)
+            for c in chromosomes:
+                tables.add(c)
+            tables.pack()
+
+            arrays = [(name, code, len(tables.arrays[name])) for name, code in ARRAYS]
+            header = pickle.dumps({'state': state,
+                                   'random': rstate,
+                                   'base': base,
+                                   'byteorder': sys.byteorder,
+                                   'arrays': arrays,
+                                   'classes': tables.classes,
+                                   'activations': tables.activations,
+                                   'extras': tables.extras}, 2)
+
+            # an interrupted write leaves no (corrupted) checkpoint behind
+            temporary = filename + '.tmp'
+            f = open(temporary, 'wb')
+            try:
+                f.write(struct.pack(HEADER, MAGIC, VERSION, len(header)))
+                f.write(header)
+                for name, code in ARRAYS:
+                    tables.arrays[name].tofile(f)
+                # on disk before the rename (a crash cannot leave an empty checkpoint)
+                f.flush()
+                os.fsync(f.fileno())
+            finally:
+                f.close()
+            os.rename(temporary, filename)
+        except:
+            if base is None:
+                self.__base = None # no deltas of a missing checkpoint
+            raise
+        if base is None:
+            # (the copies have the genes the chromosomes had)
+            self.__tables = tables
+            self.__memo = dict((key, (index, c, self.__fingerprint(chromosomes[index])))
+                               for key, (index, c) in memo.iteritems())
+
+
+if __name__ == '__main__':
+    # Checks that writing checkpoints leaves the evolution unchanged and that
+    # runs resumed from a delta or a full checkpoint end as the original one.
+    # Usage: python checkpoint.py neat.config
+    import random, shutil, tempfile
+    import config, genome, population
+
+    config.load(sys.argv[1])
+    chromosome.node_gene_type = genome.NodeGene
+
+    # sample fitness function (depends on the iteration order of the links)
+    def eval_fitness(chromosomes):
+        for c in chromosomes:
+            c.fitness = 1./(1 + sum(abs(cg.weight - 0.5)*(i % 3) for i, cg in enumerate(c.conn_genes)))
+    population.Population.evaluate = eval_fitness
+
+    def summary(pop):
+        # (ids aside, the runs of this process share the id counters)
+        return ([(c.fitness, [(cg.innovation, cg.weight) for cg in c.conn_genes])
+                 for c in pop._Population__population], pop.stats[1])
+
+    def run(generations, **options):
+        random.seed(0)
+        pop = population.Population(seed=0)
+        pop.epoch(generations, report=False, checkpoint_interval=None, **options)
+        return summary(pop)
+
+    cwd = os.getcwd()
+    directory = tempfile.mkdtemp()
+    os.chdir(directory)
+    try:
+        results = []
+        reference = run(20)
+        results.append(('checkpoints', run(20, checkpoint_generation=3, checkpoint_deltas=1)))
+        results.append(('background checkpoints', run(20, checkpoint_generation=3, checkpoint_deltas=1,
+                                                        checkpoint_background=True)))
+        # full checkpoints at generations 0, 6, 12 and 18, deltas in between
+        for generation in (9, 12):
+            pop = population.Population('checkpoint_%d' % generation)
+            pop.epoch(20 - generation - 1, report=False, checkpoint_interval=None)
+            results.append(('resumed from checkpoint_%d' % generation, summary(pop)))
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(directory)
+
+    for name, result in results:
+        print '%s: %s' % (name, result == reference and 'same evolution' or 'DIFFERENT evolution')
+    sys.exit(any(result != reference for name, result in results))
@@ -1,7 +1,11 @@
+import array
+import bisect
+import copy
 import random
 import math
 from config import Config
 import genome
+from nn import nn_pure
 
 # Temporary workaround - default settings
 #node_gene_type = genome.NodeGene
@@ -10,6 +14,9 @@ conn_gene_type = genome.ConnectionGene
 class Chromosome(object):
     """ A chromosome for general recurrent neural networks. """
     _id = 0
+    # innovation sorted (innovations, weights) of the connection genes,
+    # built when needed and dropped whenever the genes change
+    _compact_genes = None
     def __init__(self, parent1_id, parent2_id, node_gene_type, conn_gene_type):
 
         self._id = self.__get_new_id()
@@ -41,27 +48,56 @@ class Chromosome(object):
         cls._id += 1
         return cls._id
 
-    def mutate(self):
-        """ Mutates this chromosome """
+    def mutate(self, innovations=None):
+        """ Mutates this chromosome (its genes may be shared with other
+            chromosomes, so mutated genes are replaced by new ones). New
+            links are numbered by the given innovation registry.
+        """
+        if self._mutate_structure(innovations=innovations):
+            conn_genes = self._connection_genes
+            for key, cg in conn_genes.items():
+                conn_genes[key] = cg.mutate() # mutate weights
+            node_genes = self._node_genes
+            for i in xrange(self._input_nodes, len(node_genes)):
+                node_genes[i] = node_genes[i].mutate() # mutate bias, response, and etc...
+
+        return self
+
+    def _mutate_structure(self, r=random.random, innovations=None):
+        """ Adds a node or a connection, otherwise returns True (the
+            genes are to be mutated). r returns uniform random numbers.
+        """
+        # a modified chromosome needs to be evaluated again
+        self.fitness = None
+        self._compact_genes = None
 
-        r = random.random
         if r() < Config.prob_addnode:
-            self._mutate_add_node()
+            self._mutate_add_node(innovations)
 
         elif r() < Config.prob_addconn:
-            self._mutate_add_connection()
+            self._mutate_add_connection(innovations)
 
         else:
-            for cg in self._connection_genes.values():
-                cg.mutate() # mutate weights
-            for ng in self._node_genes[self._input_nodes:]:
-                ng.mutate() # mutate bias, response, and etc...
-
-        return self
+            return True
+        self._sort_connection_genes()
+        return False
+
+    def _sort_connection_genes(self):
+        """ Refills the dict of connection genes in key order. The iteration
+            order of a dict depends on how it was filled and it drives the
+            random draws of crossover and mutation, so keeping the dicts in
+            key order makes evolution only depend on the genes (a chromosome
+            loaded from a checkpoint evolves as the one saved).
+        """
+        genes = self._connection_genes
+        self._connection_genes = dict((key, genes[key]) for key in sorted(genes))
 
 
-    def crossover(self, other):
-        """ Crosses over parents' chromosomes and returns a child. """
+    def crossover(self, other, generator=None):
+        """ Crosses over parents' chromosomes and returns a child. The
+            parent of each gene attribute is drawn in bulk when a numpy
+            RandomState generator is given.
+        """
 
         # This can't happen! Parents must belong to the same species.
         assert self.species_id == other.species_id, 'Different parents species ID: %d vs %d' \
@@ -78,106 +114,138 @@ class Chromosome(object):
         # creates a new child
         child = self.__class__(self.id, other.id, self._node_gene_type, self._conn_gene_type)
 
-        child._inherit_genes(parent1, parent2)
+        if generator is None:
+            child._inherit_genes(parent1, parent2)
+        else:
+            # enough draws for every connection and node attribute
+            size = len(parent1._connection_genes) + 3*len(parent1._node_genes)
+            draw = iter((generator.random_sample(size) < 0.5).tolist()).next
+            child._inherit_genes(parent1, parent2, lambda pair: pair[draw()])
 
         child.species_id = parent1.species_id
         #child._input_nodes = parent1._input_nodes
 
         return child
 
-    def _inherit_genes(child, parent1, parent2):
-        """ Applies the crossover operator. """
+    def _inherit_genes(child, parent1, parent2, choice=random.choice):
+        """ Applies the crossover operator (choice picks one of two values).
+            The child shares the inherited genes with its parents.
+        """
         assert(parent1.fitness >= parent2.fitness)
 
-        # Crossover connection genes
-        for cg1 in parent1._connection_genes.values():
+        # Crossover connection genes (in key order, see _sort_connection_genes)
+        for key in sorted(parent1._connection_genes):
+            cg1 = parent1._connection_genes[key]
             try:
                 cg2 = parent2._connection_genes[cg1.key]
             except KeyError:
-                # Copy excess or disjoint genes from the fittest parent
-                child._connection_genes[cg1.key] = cg1.copy()
+                # Excess or disjoint genes from the fittest parent
+                child._connection_genes[cg1.key] = cg1
             else:
                 if cg2.is_same_innov(cg1): # Always true for *global* INs
                     # Homologous gene found
-                    new_gene = cg1.get_child(cg2)
+                    new_gene = cg1.get_child(cg2, choice)
                     #new_gene.enable() # avoids disconnected neurons
                 else:
-                    new_gene = cg1.copy()
+                    new_gene = cg1
                 child._connection_genes[new_gene.key] = new_gene
 
         # Crossover node genes
         for i, ng1 in enumerate(parent1._node_genes):
             try:
                 # matching node genes: randomly selects the neuron's bias and response
-                child._node_genes.append(ng1.get_child(parent2._node_genes[i]))
+                child._node_genes.append(ng1.get_child(parent2._node_genes[i], choice))
             except IndexError:
-                # copies extra genes from the fittest parent
-                child._node_genes.append(ng1.copy())
+                # extra genes from the fittest parent
+                child._node_genes.append(ng1)
 
 
-    def _mutate_add_node(self):
+    def _mutate_add_node(self, innovations=None):
         # Choose a random connection to split
-        conn_to_split = random.choice(self._connection_genes.values())
+        conn_to_split = random.choice(self._connection_genes.values()).copy()
+        self._connection_genes[conn_to_split.key] = conn_to_split # disabled by split
         ng = self._node_gene_type(len(self._node_genes) + 1, 'HIDDEN', activation_type = Config.nn_activation)
         self._node_genes.append(ng)
-        new_conn1, new_conn2 = conn_to_split.split(ng.id)
+        new_conn1, new_conn2 = conn_to_split.split(ng.id, innovations)
         self._connection_genes[new_conn1.key] = new_conn1
         self._connection_genes[new_conn2.key] = new_conn2
         return (ng, conn_to_split) # the return is only used in genome_feedforward
 
-    def _mutate_add_connection(self):
+    def _mutate_add_connection(self, innovations=None):
         # Only for recurrent networks
-        total_possible_conns = (len(self._node_genes) - self._input_nodes) \
-            * len(self._node_genes)
-        remaining_conns = total_possible_conns - len(self._connection_genes)
+        ids = [ng.id for ng in self._node_genes]
+        remaining_conns = len(ids)*(len(ids) - self._input_nodes) - len(self._connection_genes)
         # Check if new connection can be added:
         if remaining_conns > 0:
-            n = random.randint(0, remaining_conns - 1)
-            count = 0
-            # Count connections
-            for in_node in self._node_genes:
-                for out_node in self._node_genes[self._input_nodes:]:
-                    if (in_node.id, out_node.id) not in self._connection_genes.keys():
-                        # Free connection
-                        if count == n: # Connection to create
-                            weight = random.gauss(0, Config.weight_stdev)
-                            cg = self._conn_gene_type(in_node.id, out_node.id, weight, True)
-                            self._connection_genes[cg.key] = cg
-                            return
-                        else:
-                            count += 1
+            key = self._random_free_connection(ids, ids[self._input_nodes:], remaining_conns)
+            if key is not None:
+                weight = random.gauss(0, Config.weight_stdev)
+                cg = self._conn_gene_type(key[0], key[1], weight, True, registry=innovations)
+                self._connection_genes[cg.key] = cg
+
+    def _random_free_connection(self, sources, targets, remaining, allowed=None):
+        """ Returns a (source, target) pair of node ids uniformly chosen
+            among the pairs without a connection gene (and allowed), or
+            None if there are none. remaining is the expected number of
+            free pairs: random pairs are drawn until a free one is found
+            (about pairs/remaining draws), unless only a few pairs are
+            free and listing all of them is cheaper.
+        """
+        if remaining >= 16:
+            choice = random.choice
+            for attempt in xrange(4*len(sources)*len(targets)/remaining + 16):
+                key = (choice(sources), choice(targets))
+                if key not in self._connection_genes and (allowed is None or allowed(*key)):
+                    return key
+        free = [(i, o) for i in sources for o in targets
+                if (i, o) not in self._connection_genes and (allowed is None or allowed(i, o))]
+        if free:
+            return random.choice(free)
+
+    def compact_genes(self):
+        """ Returns the innovation numbers (sorted) and the weights of the
+            connection genes as two tuples (cached until the next mutation).
+        """
+        if self._compact_genes is None:
+            genes = sorted([(cg.innovation, cg.weight) for cg in self._connection_genes.itervalues()])
+            self._compact_genes = (tuple([g[0] for g in genes]), tuple([g[1] for g in genes]))
+        return self._compact_genes
 
     # compatibility function
     def distance(self, other):
-        """ Returns the distance between this chromosome and the other. """
-        if len(self._connection_genes) > len(other._connection_genes):
-            chromo1 = self
-            chromo2 = other
-        else:
-            chromo1 = other
-            chromo2 = self
+        """ Returns the distance between this chromosome and the other
+            (single merge of their innovation sorted genes).
+        """
+        innovs1, weights1 = self.compact_genes()
+        innovs2, weights2 = other.compact_genes()
+        size1 = len(innovs1)
+        size2 = len(innovs2)
 
         weight_diff = 0
         matching = 0
-        disjoint = 0
-        excess = 0
-
-        max_cg_chromo2 = max(chromo2._connection_genes.values())
-
-        for cg1 in chromo1._connection_genes.values():
-            try:
-                cg2 = chromo2._connection_genes[cg1.key]
-            except KeyError:
-                if cg1 > max_cg_chromo2:
-                    excess += 1
-                else:
-                    disjoint += 1
-            else:
+        i = j = 0
+        while i < size1 and j < size2:
+            if innovs1[i] == innovs2[j]:
                 # Homologous genes
-                weight_diff += math.fabs(cg1.weight - cg2.weight)
+                weight_diff += math.fabs(weights1[i] - weights2[j])
                 matching += 1
+                i += 1
+                j += 1
+            elif innovs1[i] < innovs2[j]:
+                i += 1
+            else:
+                j += 1
 
-        disjoint += len(chromo2._connection_genes) - matching
+        # genes of the longest chromosome after the last innovation of the other
+        if size1 > size2:
+            longest, shortest = innovs1, innovs2
+        else:
+            longest, shortest = innovs2, innovs1
+        if shortest:
+            excess = len(longest) - bisect.bisect_right(longest, shortest[-1])
+        else:
+            excess = len(longest)
+        disjoint = size1 + size2 - 2*matching - excess
 
         #assert(matching > 0) # this can't happen
         distance = Config.excess_coeficient * excess + \
@@ -198,6 +266,35 @@ class Chromosome(object):
 
         return (num_hidden, conns_enabled)
 
+    def signature(self):
+        """ Returns a hashable description of the genes: chromosomes with
+            the same signature have the same phenotype (and fitness).
+        """
+        return (tuple([ng.signature() for ng in self._node_genes]),
+                tuple(sorted([cg.signature() for cg in self._connection_genes.itervalues()])))
+
+    def packed(self, neurons=None):
+        """ Returns the neurons (hidden and output, in the given order of
+            ids or by id) and the enabled links as packed arrays: biases,
+            responses, types (0 hidden, 1 output), sources, targets and
+            weights. Sources below the number of inputs are sensors and
+            the others neurons shifted by that number (see ann.ANN.from_arrays).
+        """
+        num_inputs = self._input_nodes
+        if neurons is None:
+            neurons = [ng._id for ng in self._node_genes[num_inputs:]]
+        index = dict((id, id-1) for id in xrange(1, num_inputs+1))
+        index.update((id, num_inputs+i) for i, id in enumerate(neurons))
+        nodes = [self._node_genes[id-1].signature() for id in neurons]
+        links = [cg.signature() for cg in self._connection_genes.itervalues()]
+        links = [(index[s[0]], index[s[1]]-num_inputs, s[2]) for s in links if s[3]]
+        return (array.array('d', [s[2] for s in nodes]),
+                array.array('d', [s[3] for s in nodes]),
+                array.array('i', [s[1] == 'OUTPUT' for s in nodes]),
+                array.array('i', [s[0] for s in links]),
+                array.array('i', [s[1] for s in links]),
+                array.array('d', [s[2] for s in links]))
+
     def __cmp__(self, other):
         """ First compare chromosomes by their fitness and then by their id.
             Older chromosomes (lower ids) should be prefered if newer ones
@@ -217,7 +314,8 @@ class Chromosome(object):
             s += "\n\t" + str(c)
         return s
 
-    def add_hidden_nodes(self, num_hidden):
+    def add_hidden_nodes(self, num_hidden, innovations=None):
+        self._compact_genes = None
         id = len(self._node_genes)+1
         for i in range(num_hidden):
             node_gene = self._node_gene_type(id,
@@ -228,13 +326,14 @@ class Chromosome(object):
             # Connect all nodes to it
             for pre in self._node_genes:
                 weight = random.gauss(0, Config.weight_stdev)
-                cg = self._conn_gene_type(pre.id, node_gene.id, weight, True)
+                cg = self._conn_gene_type(pre.id, node_gene.id, weight, True, registry=innovations)
                 self._connection_genes[cg.key] = cg
             # Connect it to all nodes except input nodes
             for post in self._node_genes[self._input_nodes:]:
                 weight = random.gauss(0, Config.weight_stdev)
-                cg = self._conn_gene_type(node_gene.id, post.id, weight, True)
+                cg = self._conn_gene_type(node_gene.id, post.id, weight, True, registry=innovations)
                 self._connection_genes[cg.key] = cg
+        self._sort_connection_genes()
 
     @classmethod
     def create_unconnected(cls):
@@ -259,7 +358,7 @@ class Chromosome(object):
         return c
 
     @classmethod
-    def create_minimally_connected(cls):
+    def create_minimally_connected(cls, innovations=None):
         """
         Factory method
         Creates a chromosome for a minimally connected feedforward network with no hidden nodes. That is, each output node will have a single connection from a randomly chosen input node.
@@ -272,13 +371,14 @@ class Chromosome(object):
             input_node = random.choice(c._node_genes[:Config.input_nodes])
             weight = random.gauss(0, Config.weight_stdev)
 
-            cg = c._conn_gene_type(input_node.id, node_gene.id, weight, True)
+            cg = c._conn_gene_type(input_node.id, node_gene.id, weight, True, registry=innovations)
             c._connection_genes[cg.key] = cg
 
+        c._sort_connection_genes()
         return c
 
     @classmethod
-    def create_fully_connected(cls):
+    def create_fully_connected(cls, innovations=None):
         """
         Factory method
         Creates a chromosome for a fully connected feedforward network with no hidden nodes.
@@ -293,12 +393,40 @@ class Chromosome(object):
                 #weight = random.uniform(-1, 1)*Config.random_range
                 weight = random.gauss(0, Config.weight_stdev)
 
-                cg = c._conn_gene_type(input_node.id, node_gene.id, weight, True)
+                cg = c._conn_gene_type(input_node.id, node_gene.id, weight, True, registry=innovations)
                 c._connection_genes[cg.key] = cg
 
+        c._sort_connection_genes()
         return c
 
 
+def mutate_all(chromosomes, generator=None, innovations=None):
+    """ Mutates every chromosome as Chromosome.mutate does, though the
+        weights, biases and responses of all of them are gathered in
+        arrays and mutated at once (requires numpy, the generator is a
+        numpy RandomState). Returns the chromosomes.
+    """
+    if generator is None:
+        generator = genome.numpy.random
+    # structural mutations drawn in bulk too (at most two draws each)
+    draw = iter(generator.random_sample(2*len(chromosomes)).tolist()).next
+    perturbed = [c for c in chromosomes if c._mutate_structure(draw, innovations)]
+    if perturbed:
+        conn_genes = [cg for c in perturbed for cg in c._connection_genes.itervalues()]
+        node_genes = [ng for c in perturbed for ng in c._node_genes[c._input_nodes:]]
+        # puts back the mutated genes (in the same order)
+        mutant = iter(perturbed[0]._conn_gene_type.mutate_all(conn_genes, generator)).next
+        for c in perturbed:
+            genes = c._connection_genes
+            for key in genes:
+                genes[key] = mutant()
+        mutant = iter(perturbed[0]._node_gene_type.mutate_all(node_genes, generator)).next
+        for c in perturbed:
+            genes = c._node_genes
+            for i in xrange(c._input_nodes, len(genes)):
+                genes[i] = mutant()
+    return chromosomes
+
 class FFChromosome(Chromosome):
     """ A chromosome for feedforward neural networks. Feedforward
         topologies are a particular case of Recurrent NNs.
@@ -309,15 +437,15 @@ class FFChromosome(Chromosome):
 
     node_order = property(lambda self: self.__node_order)
 
-    def _inherit_genes(child, parent1, parent2):
-        super(FFChromosome, child)._inherit_genes(parent1, parent2)
+    def _inherit_genes(child, parent1, parent2, choice=random.choice):
+        super(FFChromosome, child)._inherit_genes(parent1, parent2, choice)
 
         child.__node_order = parent1.__node_order[:]
 
         assert(len(child.__node_order) == len([n for n in child.node_genes if n.type == 'HIDDEN']))
 
-    def _mutate_add_node(self):
-        ng, split_conn = super(FFChromosome, self)._mutate_add_node()
+    def _mutate_add_node(self, innovations=None):
+        ng, split_conn = super(FFChromosome, self)._mutate_add_node(innovations)
         # Add node to node order list: after the presynaptic node of the split connection
         # and before the postsynaptic node of the split connection
         if self._node_genes[split_conn.innodeid - 1].type == 'HIDDEN':
@@ -334,7 +462,7 @@ class FFChromosome(Chromosome):
         assert(len(self.__node_order) == len([n for n in self.node_genes if n.type == 'HIDDEN']))
         return (ng, split_conn)
 
-    def _mutate_add_connection(self):
+    def _mutate_add_connection(self, innovations=None):
         # Only for feedforwad networks
         num_hidden = len(self.__node_order)
         num_output = len(self._node_genes) - self._input_nodes - num_hidden
@@ -345,28 +473,24 @@ class FFChromosome(Chromosome):
         remaining_conns = total_possible_conns - len(self._connection_genes)
         # Check if new connection can be added:
         if remaining_conns > 0:
-            n = random.randint(0, remaining_conns - 1)
-            count = 0
-            # Count connections
-            for in_node in (self._node_genes[:self._input_nodes] + self._node_genes[-num_hidden:]):
-                for out_node in self._node_genes[self._input_nodes:]:
-                    if (in_node.id, out_node.id) not in self._connection_genes.keys() and \
-                        self.__is_connection_feedforward(in_node, out_node):
-                        # Free connection
-                        if count == n: # Connection to create
-                            #weight = random.uniform(-Config.random_range, Config.random_range)
-                            weight = random.gauss(0,1)
-                            cg = self._conn_gene_type(in_node.id, out_node.id, weight, True)
-                            self._connection_genes[cg.key] = cg
-                            return
-                        else:
-                            count += 1
+            # position of the hidden nodes (inputs go before and outputs after them)
+            position = dict((id, i) for i, id in enumerate(self.__node_order))
+            inputs = range(1, self._input_nodes+1)
+            outputs = range(self._input_nodes+1, self._input_nodes+num_output+1)
+            key = self._random_free_connection(inputs + self.__node_order, self.__node_order + outputs,
+                remaining_conns, lambda i, o: i not in position or o not in position or position[i] < position[o])
+            if key is not None:
+                #weight = random.uniform(-Config.random_range, Config.random_range)
+                weight = random.gauss(0,1)
+                cg = self._conn_gene_type(key[0], key[1], weight, True, registry=innovations)
+                self._connection_genes[cg.key] = cg
 
     def __is_connection_feedforward(self, in_node, out_node):
         return in_node.type == 'INPUT' or out_node.type == 'OUTPUT' or \
             self.__node_order.index(in_node.id) < self.__node_order.index(out_node.id)
 
-    def add_hidden_nodes(self, num_hidden):
+    def add_hidden_nodes(self, num_hidden, innovations=None):
+        self._compact_genes = None
         id = len(self._node_genes)+1
         for i in range(num_hidden):
             node_gene = self._node_gene_type(id,
@@ -378,22 +502,100 @@ class FFChromosome(Chromosome):
             # Connect all input nodes to it
             for pre in self._node_genes[:self._input_nodes]:
                 weight = random.gauss(0, Config.weight_stdev)
-                cg = self._conn_gene_type(pre.id, node_gene.id, weight, True)
+                cg = self._conn_gene_type(pre.id, node_gene.id, weight, True, registry=innovations)
                 self._connection_genes[cg.key] = cg
                 assert self.__is_connection_feedforward(pre, node_gene)
             # Connect all previous hidden nodes to it
             for pre_id in self.__node_order[:-1]:
                 assert pre_id != node_gene.id
                 weight = random.gauss(0, Config.weight_stdev)
-                cg = self._conn_gene_type(pre_id, node_gene.id, weight, True)
+                cg = self._conn_gene_type(pre_id, node_gene.id, weight, True, registry=innovations)
                 self._connection_genes[cg.key] = cg
             # Connect it to all output nodes
             for post in self._node_genes[self._input_nodes:(self._input_nodes + self._output_nodes)]:
                 assert post.type == 'OUTPUT'
                 weight = random.gauss(0, Config.weight_stdev)
-                cg = self._conn_gene_type(node_gene.id, post.id, weight, True)
+                cg = self._conn_gene_type(node_gene.id, post.id, weight, True, registry=innovations)
                 self._connection_genes[cg.key] = cg
                 assert self.__is_connection_feedforward(node_gene, post)
+        self._sort_connection_genes()
+
+    def signature(self):
+        return super(FFChromosome, self).signature() + (tuple(self.__node_order),)
+
+    def packed(self):
+        """ Packed arrays with the neurons in serial order (see Chromosome.packed) """
+        outputs = [ng.id for ng in self._node_genes[self._input_nodes:self._input_nodes+self._output_nodes]]
+        return super(FFChromosome, self).packed(self.__node_order + outputs)
+
+    def simplify(self, prune_inputs=False, exact=False):
+        """ Returns a copy with the same phenotype (evaluated as a flushed
+            network) and the list of inputs it reads (0-based). Disabled
+            links and links from later neurons are dropped, hidden nodes
+            without inputs are folded into the bias of their targets and
+            hidden nodes not reaching an output are removed. With
+            prune_inputs the unused inputs are removed too (at least one
+            is kept). The copy is meant for building phenotypes only.
+        """
+        num_inputs = self._input_nodes
+        outputs = [ng.id for ng in self._node_genes[num_inputs:num_inputs+self._output_nodes]]
+        serial = self.__node_order + outputs
+        position = dict((id, i) for i, id in enumerate(serial))
+
+        incoming = dict((id, []) for id in serial)
+        for cg in self._connection_genes.itervalues():
+            if cg.enabled and (cg.innodeid <= num_inputs or
+                               position[cg.innodeid] < position[cg.outnodeid]):
+                incoming[cg.outnodeid].append(cg)
+
+        # hidden nodes with a constant output are folded into their targets
+        bias = dict((id, self._node_genes[id-1].bias) for id in serial)
+        constant = {}
+        for id in serial:
+            links = []
+            for cg in incoming[id]:
+                if cg.innodeid in constant:
+                    bias[id] += cg.weight*constant[cg.innodeid]
+                else:
+                    links.append(cg)
+            incoming[id] = links
+            if not links and id in self.__node_order:
+                ng = self._node_genes[id-1]
+                constant[id] = nn_pure.activation_function(ng.activation_type, exact)(bias[id], ng.response)
+
+        # neurons reaching an output
+        alive = set(outputs)
+        for id in reversed(serial):
+            if id in alive:
+                alive.update(cg.innodeid for cg in incoming[id] if cg.innodeid > num_inputs)
+
+        if prune_inputs:
+            inputs = sorted(set(cg.innodeid for id in alive for cg in incoming[id]
+                                if cg.innodeid <= num_inputs)) or [1]
+        else:
+            inputs = range(1, num_inputs+1)
+        hidden = [id for id in self.__node_order if id in alive]
+
+        # new ids: inputs, outputs and hidden nodes
+        ids = dict((id, i+1) for i, id in enumerate(inputs + outputs + hidden))
+        chromo = copy.copy(self)
+        chromo._compact_genes = None
+        chromo._input_nodes = len(inputs)
+        chromo._node_genes = []
+        for id in inputs + outputs + hidden:
+            ng = copy.copy(self._node_genes[id-1])
+            ng._id = ids[id]
+            if id in bias:
+                ng._bias = bias[id]
+            chromo._node_genes.append(ng)
+        chromo.__node_order = [ids[id] for id in hidden]
+        chromo._connection_genes = {}
+        for id in outputs + hidden:
+            for cg in incoming[id]:
+                cg = self._conn_gene_type(ids[cg.innodeid], ids[id], cg.weight, True, cg.innovation)
+                chromo._connection_genes[cg.key] = cg
+
+        return chromo, [id-1 for id in inputs]
 
     def __str__(self):
         s = super(FFChromosome, self).__str__()
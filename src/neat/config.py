@@ -21,7 +21,7 @@ def load(file):
         Config.max_weight           =     float(parameters.get('phenotype','max_weight'))
         Config.min_weight           =     float(parameters.get('phenotype','min_weight'))
         Config.feedforward          =  bool(int(parameters.get('phenotype','feedforward')))
-        Config.nn_activation        =           parameters.get('phenotype','nn_activation')  # exp or tanh
+        Config.nn_activation        =           parameters.get('phenotype','nn_activation')  # exp or tanh (fast_exp or fast_tanh for tables)
         Config.weight_stdev         =     float(parameters.get('phenotype','weight_stdev'))
 
         # GA
@@ -35,6 +35,13 @@ def load(file):
         Config.weight_mutation_power    = float(parameters.get('genetic','weight_mutation_power'))
         Config.prob_togglelink          = float(parameters.get('genetic','prob_togglelink'))
         Config.elitism                  = float(parameters.get('genetic','elitism'))
+        # optional: mutates the weights of all the offspring at once and draws the
+        # random numbers of reproduction in bulk (requires numpy)
+        Config.vectorized_mutation      = parameters.has_option('genetic','vectorized_mutation') and \
+                                          bool(int(parameters.get('genetic','vectorized_mutation')))
+        # optional: innovations kept at each generation (global, generation or compact)
+        if parameters.has_option('genetic','innovation_policy'):
+            Config.innovation_policy    =           parameters.get('genetic','innovation_policy')
 
         # genotype compatibility
         Config.compatibility_threshold  = float(parameters.get('genotype compatibility','compatibility_threshold'))
@@ -76,6 +83,8 @@ class Config:
     weight_mutation_power   = None
     prob_togglelink         = None
     elitism                 = None
+    vectorized_mutation     = False
+    innovation_policy       = 'global'
 
     #prob_crossover = 0.7  # not implemented (always apply crossover)
     #prob_weightreplaced = 0.0 # not implemented
@@ -13,7 +13,7 @@ def create_phenotype(chromo):
     #network.set_rk4(0.01) # integration method
     network.set_euler(0.01)
 
-    if chromo.node_genes[-1].activation_type == 'tanh':
+    if chromo.node_genes[-1].activation_type.endswith('tanh'):
         network.set_logistic(False)
 
     # create neurons
@@ -1,11 +1,22 @@
 # -*- coding: UTF-8 -*-
+import itertools
 import random
 from config import Config
 
+try:
+    import numpy
+except ImportError:
+    numpy = None # only needed by mutate_all
+
 class NodeGene(object):
+    # no per-instance __dict__ (genes are the bulk of a population)
+    __slots__ = ('_id', '_type', '_bias', '_response', '_activation_type')
+    _fields = __slots__ # attributes of genes pickled with a __dict__
+
     def __init__(self, id, nodetype, bias=0, response=4.924273, activation_type=None):
         """ A node gene encodes the basic artificial neuron model.
-            nodetype should be "INPUT", "HIDDEN", or "OUTPUT"
+            nodetype should be "INPUT", "HIDDEN", or "OUTPUT". Genes are
+            shared between chromosomes: mutations return a modified copy.
         """
         self._id = id
         self._type = nodetype
@@ -25,15 +36,39 @@ class NodeGene(object):
         return "Node %2d %6s, bias %+2.10s, response %+2.10s" \
                 %(self._id, self._type, self._bias, self._response)
 
-    def get_child(self, other):
-        """ Creates a new NodeGene ramdonly inheriting its attributes from parents """
+    def signature(self):
+        """ Returns the attributes defining the neuron """
+        return (self._id, self._type, self._bias, self._response, self._activation_type)
+
+    def __reduce__(self):
+        # pickled as a constructor call (compact and fast)
+        return (self.__class__, (self._id, self._type, self._bias, self._response,
+                                 self._activation_type))
+
+    def __setstate__(self, state):
+        # genes pickled before __slots__ carry their __dict__
+        for name in self._fields:
+            setattr(self, name, state[name])
+
+    def get_child(self, other, choice=random.choice):
+        """ Returns a NodeGene ramdonly inheriting its attributes from parents
+            (one of them when it has all the chosen attributes)
+        """
         assert(self._id == other._id)
 
-        ng = NodeGene(self._id, self._type,
-                      random.choice((self._bias, other._bias)),
-                      random.choice((self._response, other._response)),
+        attributes = (self._id, self._type,
+                      choice((self._bias, other._bias)),
+                      choice((self._response, other._response)),
                       self._activation_type)
-        return ng
+        return self._shared(other, attributes)
+
+    def _shared(self, other, attributes):
+        """ Returns the parent gene with the given attributes or a new one """
+        if self.signature() == attributes:
+            return self
+        if other.signature() == attributes:
+            return other
+        return self.__class__(*attributes)
 
     def __mutate_bias(self):
         #self._bias += random.uniform(-1, 1) * Config.bias_mutation_power
@@ -53,11 +88,46 @@ class NodeGene(object):
                         self._response, self._activation_type)
 
     def mutate(self):
+        """ Returns the mutated gene (a copy, or the gene itself if unchanged) """
         r = random.random
+        ng = self
         if r() < Config.prob_mutatebias:
-            self.__mutate_bias()
+            ng = self.copy()
+            ng.__mutate_bias()
         if r() < Config.prob_mutatebias:
-            self.__mutate_response()
+            if ng is self:
+                ng = self.copy()
+            ng.__mutate_response()
+        return ng
+
+    @staticmethod
+    def mutate_all(genes, generator):
+        """ Mutates a list of node genes at once (same as calling mutate
+            for each one) using a numpy RandomState generator. Returns the
+            list of mutated genes.
+        """
+        size = len(genes)
+        biases = numpy.fromiter((ng._bias for ng in genes), float, size)
+        responses = numpy.fromiter((ng._response for ng in genes), float, size)
+
+        mutated = generator.random_sample(size) < Config.prob_mutatebias
+        biases[mutated] = numpy.clip(biases[mutated] + Config.bias_mutation_power*
+                                     generator.standard_normal(mutated.sum()),
+                                     Config.min_weight, Config.max_weight)
+        changed = mutated
+        mutated = generator.random_sample(size) < Config.prob_mutatebias
+        responses[mutated] += Config.bias_mutation_power*generator.standard_normal(mutated.sum())
+        changed = changed | mutated
+
+        mutants = []
+        for ng, bias, response, change in itertools.izip(genes, biases.tolist(),
+                                                         responses.tolist(), changed.tolist()):
+            if change:
+                ng = ng.copy()
+                ng._bias = bias
+                ng._response = response
+            mutants.append(ng)
+        return mutants
 
 
 class CTNodeGene(NodeGene):
@@ -65,6 +135,9 @@ class CTNodeGene(NodeGene):
         The main difference here is the addition of
         a decay rate given by the time constant.
     """
+    __slots__ = ('_time_constant',)
+    _fields = NodeGene._fields + __slots__
+
     def __init__(self, id, nodetype, bias = 1.0, response = 1.0, activation_type = 'exp', time_constant = 1.0):
         super(CTNodeGene, self).__init__(id, nodetype, bias, response, activation_type)
 
@@ -73,7 +146,7 @@ class CTNodeGene(NodeGene):
     time_constant = property(lambda self: self._time_constant)
 
     def mutate(self):
-        super(CTNodeGene, self).mutate()
+        return super(CTNodeGene, self).mutate()
         # mutating the time constant could bring numerical instability
         # do it with caution
         #if random.random() < 0.1:
@@ -88,16 +161,23 @@ class CTNodeGene(NodeGene):
             self._time_constant = Config.min_weight
         return self
 
-    def get_child(self, other):
-        """ Creates a new NodeGene ramdonly inheriting its attributes from parents """
+    def get_child(self, other, choice=random.choice):
+        """ Returns a CTNodeGene ramdonly inheriting its attributes from parents """
         assert(self._id == other._id)
 
-        ng = CTNodeGene(self._id, self._type,
-                      random.choice((self._bias, other._bias)),
-                      random.choice((self._response, other._response)),
+        attributes = (self._id, self._type,
+                      choice((self._bias, other._bias)),
+                      choice((self._response, other._response)),
                       self._activation_type,
-                      random.choice((self._time_constant, other._time_constant)))
-        return ng
+                      choice((self._time_constant, other._time_constant)))
+        return self._shared(other, attributes)
+
+    def signature(self):
+        return super(CTNodeGene, self).signature() + (self._time_constant,)
+
+    def __reduce__(self):
+        return (CTNodeGene, (self._id, self._type, self._bias, self._response,
+                             self._activation_type, self._time_constant))
 
     def __str__(self):
         return "Node %2d %6s, bias %+2.10s, response %+2.10s, activation %s, time constant %+2.5s" \
@@ -109,50 +189,134 @@ class CTNodeGene(NodeGene):
                           self._response, self._activation_type, self._time_constant)
 
 
+class InnovationRegistry(object):
+    """ Innovation numbers of the connection genes by (in, out) key. The
+        policy sets what is kept at each new generation: 'global' keeps every
+        key (a link always gets the same number), 'generation' forgets them
+        (innovations are only shared within a generation, as in Stanley's
+        NEAT) and 'compact' keeps the keys still used by the population.
+        New numbers always grow.
+    """
+    policies = ('global', 'generation', 'compact')
+
+    def __init__(self, policy='global'):
+        if policy not in self.policies:
+            raise ValueError('Unknown innovation policy: %s' % policy)
+        self.policy = policy
+        self.number = 0 # last innovation number given
+        self.innovations = {}
+
+    def __len__(self):
+        return len(self.innovations)
+
+    def innovation(self, key):
+        """ Returns the innovation number of the link key=(in, out) """
+        try:
+            return self.innovations[key]
+        except KeyError:
+            self.number += 1
+            self.innovations[key] = self.number
+            return self.number
+
+    def reset(self):
+        self.innovations = {}
+
+    def register(self, chromosomes):
+        """ Adds the links of the given chromosomes (e.g. created before the registry) """
+        for c in chromosomes:
+            for cg in c.conn_genes:
+                self.innovations.setdefault(cg.key, cg.innovation)
+                self.number = max(self.number, cg.innovation)
+
+    def new_generation(self, chromosomes):
+        """ Applies the policy, chromosomes being the parents of the new generation """
+        if self.policy == 'generation':
+            self.reset()
+        elif self.policy == 'compact':
+            self.reset()
+            self.register(chromosomes)
+
+
 class ConnectionGene(object):
-    __global_innov_number = 0
-    __innovations = {} # A list of innovations.
-    # Should it be global? Reset at every generation? Who knows?
+    # no per-instance __dict__ (genes are the bulk of a population)
+    __slots__ = ('__in', '__out', '__weight', '__enabled', '__innov_number')
+    # attributes of genes pickled with a __dict__ (slot names are mangled)
+    _fields = ('_ConnectionGene__in', '_ConnectionGene__out', '_ConnectionGene__weight',
+               '_ConnectionGene__enabled', '_ConnectionGene__innov_number')
+
+    # innovations of the links created without a registry (populations
+    # pass their own one)
+    registry = InnovationRegistry()
 
     @classmethod
     def reset_innovations(cls):
-        cls.__innovations = {}
+        cls.registry.reset()
 
-    def __init__(self, innodeid, outnodeid, weight, enabled, innov = None):
+    def __init__(self, innodeid, outnodeid, weight, enabled, innov = None, registry = None):
         self.__in = innodeid
         self.__out = outnodeid
         self.__weight = weight
         self.__enabled = enabled
         if innov is None:
-            try:
-                self.__innov_number = self.__innovations[self.key]
-            except KeyError:
-                self.__innov_number = self.__get_new_innov_number()
-                self.__innovations[self.key] = self.__innov_number
-        else:
-            self.__innov_number = innov
+            if registry is None:
+                registry = self.registry
+            innov = registry.innovation((innodeid, outnodeid))
+        self.__innov_number = innov
 
     weight    = property(lambda self: self.__weight)
     innodeid  = property(lambda self: self.__in)
     outnodeid = property(lambda self: self.__out)
     enabled   = property(lambda self: self.__enabled)
+    innovation = property(lambda self: self.__innov_number)
     # Key for dictionaries, avoids two connections between the same nodes.
     key = property(lambda self: (self.__in, self.__out))
 
     def mutate(self):
+        """ Returns the mutated gene (a copy, or the gene itself if unchanged) """
         r = random.random
+        cg = self
         if r() < Config.prob_mutate_weight:
-            self.__mutate_weight()
-        if r() <  Config.prob_togglelink:
-            self.enable()
+            cg = self.copy()
+            cg.__mutate_weight()
+        if r() <  Config.prob_togglelink and not cg.__enabled:
+            if cg is self:
+                cg = self.copy()
+            cg.enable()
         #TODO: Remove weight_replaced?
         #if r() < 0.001:
         #    self.__weight_replaced()
+        return cg
 
     def enable(self):
         """ Enables a link. """
         self.__enabled = True
 
+    @staticmethod
+    def mutate_all(genes, generator):
+        """ Mutates a list of connection genes at once (same as calling
+            mutate for each one) using a numpy RandomState generator.
+            Returns the list of mutated genes.
+        """
+        size = len(genes)
+        weights = numpy.fromiter((cg.__weight for cg in genes), float, size)
+
+        mutated = generator.random_sample(size) < Config.prob_mutate_weight
+        weights[mutated] = numpy.clip(weights[mutated] + Config.weight_mutation_power*
+                                      generator.standard_normal(mutated.sum()),
+                                      Config.min_weight, Config.max_weight)
+        enabled = generator.random_sample(size) < Config.prob_togglelink
+
+        mutants = []
+        for cg, weight, change, enable in itertools.izip(genes, weights.tolist(),
+                                                         mutated.tolist(), enabled.tolist()):
+            if change or (enable and not cg.__enabled):
+                cg = cg.copy()
+                cg.__weight = weight
+                if enable:
+                    cg.__enabled = True
+            mutants.append(cg)
+        return mutants
+
     def __mutate_weight(self):
         #self.__weight += random.uniform(-1,1) * Config.weight_mutation_power
         self.__weight += random.gauss(0,1)*Config.weight_mutation_power
@@ -166,11 +330,6 @@ class ConnectionGene(object):
         #self.__weight = random.uniform(-Config.random_range, Config.random_range)
         self.__weight = random.gauss(0, Config.weight_stdev)
 
-    @classmethod
-    def __get_new_innov_number(cls):
-        cls.__global_innov_number += 1
-        return cls.__global_innov_number
-
     def __str__(self):
         s = "In %2d, Out %2d, Weight %+3.5f, " % (self.__in, self.__out, self.__weight)
         if self.__enabled:
@@ -182,11 +341,28 @@ class ConnectionGene(object):
     def __cmp__(self, other):
         return cmp(self.__innov_number, other.__innov_number)
 
-    def split(self, node_id):
-        """ Splits a connection, creating two new connections and disabling this one """
+    def signature(self):
+        """ Returns the attributes defining the link (innovation aside) """
+        return (self.__in, self.__out, self.__weight, self.__enabled)
+
+    def __reduce__(self):
+        # pickled as a constructor call (compact and fast)
+        return (ConnectionGene, (self.__in, self.__out, self.__weight,
+                                 self.__enabled, self.__innov_number))
+
+    def __setstate__(self, state):
+        # genes pickled before __slots__ carry their __dict__
+        for name in self._fields:
+            setattr(self, name, state[name])
+
+    def split(self, node_id, registry = None):
+        """ Splits a connection, creating two new connections (numbered by the
+            given innovation registry) and disabling this one (call it on a
+            copy, the gene may be shared with other chromosomes)
+        """
         self.__enabled = False
-        new_conn1 = ConnectionGene(self.__in, node_id, 1.0, True)
-        new_conn2 = ConnectionGene(node_id, self.__out, self.__weight, True)
+        new_conn1 = ConnectionGene(self.__in, node_id, 1.0, True, registry = registry)
+        new_conn2 = ConnectionGene(node_id, self.__out, self.__weight, True, registry = registry)
         return new_conn1, new_conn2
 
     def copy(self):
@@ -196,6 +372,6 @@ class ConnectionGene(object):
     def is_same_innov(self, cg):
         return self.__innov_number == cg.__innov_number
 
-    def get_child(self, cg):
+    def get_child(self, cg, choice=random.choice):
         # TODO: average both weights (Stanley, p. 38)
-        return random.choice((self, cg)).copy()
+        return choice((self, cg)) # shared, genes are copied on mutation
@@ -5,23 +5,67 @@
 // g++ -I /usr/include/python2.5/ -c ANN.cpp
 // g++ -lpython2.5 ANN.o -o ann.out
 
+#include <algorithm>
 #include <iostream>
+#ifdef _OPENMP
+#include <omp.h>
+#endif
 #include "ANN.h"
 
-ANN::ANN(int inputs, int neurons) {
+namespace {
 
-    sensors = inputs;
-    size = neurons;
-    logistic = true;
+// A function tabulated in [lower, upper] and linearly interpolated,
+// outside the range it takes the value at the closest end
+class SigmoidTable {
+    public:
+        SigmoidTable(double (*function)(double), double lower, double upper, int points) :
+            lower(lower), upper(upper), scale(points/(upper - lower)), values(points + 1) {
+            for (int k = 0; k <= points; k++)
+                values[k] = function(lower + k/scale);
+        }
 
-    sensory_weights = new double*[sensors];
-    weights = new double*[size];
+        double operator()(double x) const {
+            if (x <= lower) return values.front();
+            if (x >= upper) return values.back();
+            double position = (x - lower)*scale;
+            int k = int(position);
+            double fraction = position - k;
+            return values[k] + fraction*(values[k+1] - values[k]);
+        }
 
-    for(int i=0; i<sensors; i++)
-        sensory_weights[i] = new double[size];
+    private:
+        double lower, upper, scale;
+        std::vector<double> values;
+};
 
-    for(int i=0; i<size; i++)
-        weights[i] = new double[size];
+double logistic_function(double x) { return 1.0/(1.0 + exp(-x)); }
+double tanh_function(double x) { return tanh(x); }
+
+// same tables as the NumPy implementation (nn_numpy)
+const SigmoidTable logistic_table(logistic_function, -16.0, 16.0, 2048);
+const SigmoidTable tanh_table(tanh_function, -8.0, 8.0, 2048);
+
+// inputs of an event as doubles (floats are copied into the buffer)
+inline const double* event_inputs(const double* inputs, std::vector<double>& buffer) {
+    return inputs;
+}
+
+inline const double* event_inputs(const float* inputs, std::vector<double>& buffer) {
+    std::copy(inputs, inputs + buffer.size(), buffer.begin());
+    return &buffer[0];
+}
+
+}
+
+ANN::ANN(int inputs, int neurons, bool sparse) {
+
+    sensors = inputs;
+    size = neurons;
+    logistic = true;
+    fast_sigmoid = false;
+    threads = 1;
+    this->sparse = sparse;
+    compressed = true;
 
     states   = new double[size];
     outputs  = new double[size];
@@ -39,6 +83,23 @@ ANN::ANN(int inputs, int neurons) {
         neuron_type[i] = 0;
     }
 
+    if (sparse) {
+        // no connections yet
+        weights = 0;
+        sensory_weights = 0;
+        row_start.assign(size + 1, 0);
+        return;
+    }
+
+    sensory_weights = new double*[sensors];
+    weights = new double*[size];
+
+    for(int i=0; i<sensors; i++)
+        sensory_weights[i] = new double[size];
+
+    for(int i=0; i<size; i++)
+        weights[i] = new double[size];
+
     for(int i=0; i<sensors; i++) {
         for(int j=0; j<size; j++) {
             sensory_weights[i][j] = 0.0;
@@ -55,6 +116,15 @@ ANN::ANN(int inputs, int neurons) {
 
 ANN::~ANN()
 {
+    delete[] states;
+    delete[] outputs;
+    delete[] biases;
+    delete[] response;
+    
+    delete[] neuron_type;
+
+    if (sparse) return;
+
     for(int i=0; i<sensors; i++)
         delete[] sensory_weights[i];
     
@@ -63,135 +133,224 @@ ANN::~ANN()
     
     delete[] sensory_weights;
     delete[] weights;
-    
-    delete[] states;
-    delete[] outputs;
-    delete[] biases;
-    delete[] response;
-    
-    delete[] neuron_type;
 }
 
-// flushes all neuron's output
-void ANN::flush() {
+// sets all the neurons at once
+void ANN::set_neurons(const double* bias, const double* gain, const int* type) {
     for (int i = 0; i < size; i++) {
-        outputs[i] = 0.0;
+        set_neuron(i, bias[i], gain[i], type[i]);
     }
 }
 
-// serial activation method (for feedforward topologies)
-PyObject* ANN::sactivate(PyObject* inputs)
-{
-    if (PyList_Size(inputs) != sensors) {
-        PyErr_SetString(PyExc_ValueError, "Wrong number of inputs.");
-        return 0;
+// sets n connections at once
+void ANN::set_links(int n, const int* from, const int* to, const double* value) {
+    if (sparse) links.reserve(links.size() + n);
+    for (int k = 0; k < n; k++) {
+        if (from[k] < sensors)
+            set_sensory_weight(from[k], to[k], value[k]);
+        else
+            set_synapse(from[k] - sensors, to[k], value[k]);
     }
+}
 
-    PyObject* output = PyList_New(0);
-    if (!output) return 0;
+// sparse mode: stores a connection (built into rows before activating)
+void ANN::add_link(int from, int to, double value) {
+    Link link = {from, to, value};
+    links.push_back(link);
+    compressed = false;
+}
 
-    double neuron_input, inputjd;
-    PyObject* inputj;
+// sparse mode: builds the compressed rows from the stored connections
+void ANN::compress() {
+    // sources are sorted as in the dense matrices (sensors first) so
+    // both modes add the same terms in the same order
+    std::stable_sort(links.begin(), links.end());
+
+    // the last value set for a connection is the one kept
+    std::vector<Link> unique;
+    for (size_t k = 0; k < links.size(); k++) {
+        if (!unique.empty() && unique.back().from == links[k].from && unique.back().to == links[k].to)
+            unique.back() = links[k];
+        else
+            unique.push_back(links[k]);
+    }
+    links.swap(unique);
+
+    row_start.assign(size + 1, 0);
+    sources.resize(links.size());
+    link_weights.resize(links.size());
+    for (size_t k = 0; k < links.size(); k++) {
+        row_start[links[k].to + 1]++;
+        sources[k] = links[k].from;
+        link_weights[k] = links[k].weight;
+    }
+    for (int i = 0; i < size; i++)
+        row_start[i + 1] += row_start[i];
 
-    // Update the state of all neurons.
-    for (int i = 0; i < size; i++) {
-        neuron_input = 0.0;
+    compressed = true;
+}
 
-        // inputs from the outside (sensors)
-        for (int j = 0; j < sensors; j++) {
-            inputj = PyList_GetItem(inputs, j);
+// flushes all neuron's output
+void ANN::flush() {
+    for (int i = 0; i < size; i++) {
+        outputs[i] = 0.0;
+    }
+}
 
-            if (!inputj) {
-                Py_DECREF(output);
-                return 0;
-            }
+// number of output neurons
+int ANN::get_num_outputs() {
+    int count = 0;
+    for (int i = 0; i < size; i++)
+        if (neuron_type[i] == 1) count++;
+    return count;
+}
 
-            inputjd = PyFloat_AsDouble(inputj);
+// converts a python list of inputs into a plain array
+bool ANN::read_inputs(PyObject* inputs, double* values) {
 
-            // pode dar problemas ao rodar a main()
-            //if (PyErr_Occurred()) {
-            //    Py_DECREF(output);
-            //    return 0;
-            //}
+    if (PyList_Size(inputs) != sensors) {
+        PyErr_SetString(PyExc_ValueError, "Wrong number of inputs.");
+        return false;
+    }
 
-            neuron_input += sensory_weights[j][i] * inputjd;
-        }
-        // signal coming from other neurons
-        for (int j = 0; j < size; j++)
-            neuron_input += weights[j][i] * outputs[j];
+    for (int j = 0; j < sensors; j++) {
+        values[j] = PyFloat_AsDouble(PyList_GET_ITEM(inputs, j));
+        if (values[j] == -1.0 && PyErr_Occurred())
+            return false;
+    }
+    return true;
+}
 
-        states[i]  = neuron_input;
+// builds a python list with the output neurons
+PyObject* ANN::write_outputs() {
 
-        outputs[i] = sigmoid(states[i] + biases[i], response[i]);
+    PyObject* output = PyList_New(get_num_outputs());
+    if (!output) return 0;
 
+    int k = 0;
+    for (int i = 0; i < size; i++) {
         if(neuron_type[i] == 1) {
             PyObject* newoutput = PyFloat_FromDouble(outputs[i]);
-            if (PyList_Append(output, newoutput) != 0) {
+            if (!newoutput) {
                 Py_DECREF(output);
                 return 0;
             }
-            Py_DECREF(newoutput);
+            PyList_SET_ITEM(output, k++, newoutput);
         }
     }
     return output;
 }
 
-// parallel activation method (for recurrent neural networks)
-PyObject*  ANN::pactivate(PyObject* inputs) {
+// weighted sum of the signals arriving at neuron i
+inline double ANN::neuron_input(int i, const double* inputs, const double* outputs) {
 
-    if (PyList_Size(inputs) != sensors) {
-        PyErr_SetString(PyExc_ValueError, "Wrong number of inputs.");
-        return 0;
+    double sum = 0.0;
+
+    if (sparse) {
+        for (int k = row_start[i]; k < row_start[i+1]; k++) {
+            int j = sources[k];
+            if (j < sensors)
+                sum += link_weights[k] * inputs[j];
+            else
+                sum += link_weights[k] * outputs[j - sensors];
+        }
+        return sum;
     }
 
-    PyObject* output = PyList_New(0);
-    if (!output) return 0;
+    // inputs from the outside (sensors)
+    for (int j = 0; j < sensors; j++)
+        sum += sensory_weights[j][i] * inputs[j];
 
-    double neuron_input, inputjd;
-    PyObject* inputj;
+    // signal coming from other neurons
+    for (int j = 0; j < size; j++)
+        sum += weights[j][i] * outputs[j];
+
+    return sum;
+}
+
+// updates all the neurons one at a time
+void ANN::serial_update(const double* inputs, double* states, double* outputs) {
 
-    // Update the state of all neurons.
     for (int i = 0; i < size; i++) {
-        neuron_input = 0.0;
+        states[i]  = neuron_input(i, inputs, outputs);
+        outputs[i] = sigmoid(states[i] + biases[i], response[i]);
+    }
+}
 
-        // inputs from the outside (sensors)
-        for (int j = 0; j < sensors; j++) {
-            inputj = PyList_GetItem(inputs, j);
-            if (!inputj) {
-                Py_DECREF(output);
-                return 0;
-            }
+// serial activation method (for feedforward topologies)
+PyObject* ANN::sactivate(PyObject* inputs)
+{
+    double* values = new double[sensors];
 
-            inputjd = PyFloat_AsDouble(inputj);
+    if (!read_inputs(inputs, values)) {
+        delete[] values;
+        return 0;
+    }
+
+    // Update the state of all neurons.
+    prepare();
+    serial_update(values, states, outputs);
+    delete[] values;
 
-            // pode dar problemas ao rodar a main()
-            //if (PyErr_Occurred()) {
-            //    Py_DECREF(output);
-            //    return 0;
-           // }
+    return write_outputs();
+}
 
-            neuron_input += sensory_weights[j][i] * inputjd;
+// serial activation of a batch of events (for feedforward topologies)
+template <typename Real>
+void ANN::sactivate_batch(const Real* inputs, Real* net_outputs, int events)
+{
+    std::vector<int> output_neurons;
+    for (int i = 0; i < size; i++)
+        if(neuron_type[i] == 1)
+            output_neurons.push_back(i);
+    int num_outputs = output_neurons.size();
+
+#ifdef _OPENMP
+    #pragma omp parallel num_threads(threads)
+#endif
+    {
+        // every thread works on its own copy of the neuron states
+        std::vector<double> event_states(size), event_outputs(size), buffer(sensors);
+
+#ifdef _OPENMP
+        #pragma omp for schedule(static)
+#endif
+        for (int e = 0; e < events; e++) {
+            // every event starts from a flushed network
+            std::fill(event_outputs.begin(), event_outputs.end(), 0.0);
+            serial_update(event_inputs(inputs + e*sensors, buffer),
+                          &event_states[0], &event_outputs[0]);
+
+            for (int k = 0; k < num_outputs; k++)
+                net_outputs[e*num_outputs + k] = event_outputs[output_neurons[k]];
         }
+    }
+}
 
-        // signal coming from other neurons
-        for (int j = 0; j < size; j++)
-            neuron_input += weights[j][i] * outputs[j];
+template void ANN::sactivate_batch<double>(const double*, double*, int);
+template void ANN::sactivate_batch<float>(const float*, float*, int);
 
-        states[i] = neuron_input;
+// parallel activation method (for recurrent neural networks)
+PyObject*  ANN::pactivate(PyObject* inputs) {
+
+    double* values = new double[sensors];
+
+    if (!read_inputs(inputs, values)) {
+        delete[] values;
+        return 0;
     }
 
-    for (int i = 0; i < size; i++) {
+    prepare();
+
+    // Update the state of all neurons.
+    for (int i = 0; i < size; i++)
+        states[i] = neuron_input(i, values, outputs);
+    delete[] values;
+
+    for (int i = 0; i < size; i++)
         outputs[i] = sigmoid(states[i] + biases[i], response[i]);
-        if(neuron_type[i] == 1) {
-            PyObject* newoutput = PyFloat_FromDouble(outputs[i]);
-            if (PyList_Append(output, newoutput) != 0) {
-                Py_DECREF(output);
-                return 0;
-            }
-            Py_DECREF(newoutput);
-        }
-    }
-   return output;
+
+   return write_outputs();
 }
 
 // The sigmoid function
@@ -201,6 +360,8 @@ inline double ANN::sigmoid(double x, double response) {
             return 0.0;
         else if (x > 30.0)
             return 1.0;
+        else if (fast_sigmoid)
+            return logistic_table(x*response);
         else
             return 1.0/(1.0 + exp(-x*response));
     }
@@ -209,6 +370,8 @@ inline double ANN::sigmoid(double x, double response) {
             return -1.0;
         else if (x > 20.0)
             return 1.0;
+        else if (fast_sigmoid)
+            return tanh_table(x*response);
         else
             return tanh(x*response);
     }
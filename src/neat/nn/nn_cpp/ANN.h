@@ -9,16 +9,23 @@
 #define _ANN_H_
 
 #include <Python.h>
+#include <vector>
 
 class ANN {
     public:
-        ANN(int inputs, int neurons);
+        // in sparse mode the connections are kept in compressed
+        // rows (one per neuron) instead of dense matrices, so the
+        // activation cost scales with the number of connections
+        ANN(int inputs, int neurons, bool sparse = false);
         ~ANN();
 
         void set_synapse(int from, int to, double value) {
-            weights[from][to] = value; };
+            if (sparse) add_link(sensors + from, to, value);
+            else weights[from][to] = value; };
 
-        void set_sensory_weight(int from, int to, double value) {sensory_weights[from][to] = value;};
+        void set_sensory_weight(int from, int to, double value) {
+            if (sparse) add_link(from, to, value);
+            else sensory_weights[from][to] = value; };
 
         void set_neuron(int i, double bias, double gain, int type) {
             biases[i] = bias;
@@ -26,6 +33,15 @@ class ANN {
             neuron_type[i] = type;
         };
 
+        // sets all the neurons at once from arrays of size 'neurons'
+        void set_neurons(const double* bias, const double* gain, const int* type);
+
+        // sets n connections at once; sources below 'sensors' are
+        // inputs and the others are neurons shifted by 'sensors'
+        void set_links(int n, const int* from, const int* to, const double* value);
+
+        int get_size() { return size; };
+
         double get_neuron_response(int i) { return response[i]; }
         double get_neuron_bias(int i) { return biases[i]; }
 
@@ -34,11 +50,33 @@ class ANN {
 
         double get_neuron_output(int i) { return outputs[i]; };
 
+        // number of output neurons
+        int get_num_outputs();
+        int get_num_sensors() { return sensors; };
+
         // serial activation method (for feedforward topologies)
         PyObject* sactivate(PyObject* inputs);
         // parallel activation method (for recurrent neural networks)
         PyObject* pactivate(PyObject* inputs);
 
+        // serial activation of a batch of events stored row by row
+        // (events x sensors), each one from a flushed network; the
+        // outputs are written row by row in (events x outputs). The
+        // network state is left untouched, the events are split among
+        // the threads and it does not need the python interpreter
+        // once the network is prepared. Events can be stored as
+        // doubles or floats (the network always works in double).
+        template <typename Real>
+        void sactivate_batch(const Real* inputs, Real* net_outputs, int events);
+
+        // builds the internal structures needed for activating the
+        // network (it must be called before any batch activation)
+        void prepare() { if (!compressed) compress(); };
+
+        // number of threads used by the batch activation
+        void set_threads(int n) { threads = n > 0 ? n : 1; };
+        int get_threads() { return threads; };
+
         // flushes all neuron's output
         void flush();
 
@@ -48,14 +86,33 @@ class ANN {
 
         double sigmoid(double x, double response);
 
-       // void use_fast_sigmoid(bool b) {
-       //     fast_sigmoid = b;
-       // }
+        // the sigmoid is interpolated from a table (maximum absolute
+        // error 3e-6 for exp and 6e-6 for tanh)
+        void use_fast_sigmoid(bool b) {
+            fast_sigmoid = b;
+        };
 
    private:
+        // converts a python list of inputs into a plain array
+        bool read_inputs(PyObject* inputs, double* values);
+        // builds a python list with the output neurons
+        PyObject* write_outputs();
+
+        // updates all the neurons one at a time
+        void serial_update(const double* inputs, double* states, double* outputs);
+
+        // weighted sum of the signals arriving at neuron i
+        double neuron_input(int i, const double* inputs, const double* outputs);
+
+        // sparse mode: stores a connection and builds the compressed rows
+        void add_link(int from, int to, double value);
+        void compress();
+
         int size;      // number of neurons (hidden + output)
         int sensors;   // number of sensors (inputs)
         bool logistic; // activation type (exp or tanh)
+        bool fast_sigmoid; // table based activation
+        int threads;   // number of threads for batch activation
 
         // neuron's properties
         double *states, *outputs, *biases, *response;
@@ -69,5 +126,20 @@ class ANN {
         // connections (hidden and outputs)
         double **weights, **sensory_weights;
 
+        // sparse mode: connections arriving at neuron i are stored in
+        // [row_start[i], row_start[i+1]); sources below 'sensors' are
+        // inputs and the others are neurons shifted by 'sensors'
+        struct Link {
+            int from, to;
+            double weight;
+            bool operator<(const Link& other) const {
+                return to < other.to || (to == other.to && from < other.from);
+            }
+        };
+        bool sparse, compressed;
+        std::vector<Link> links;
+        std::vector<int> row_start, sources;
+        std::vector<double> link_weights;
+
 };
 #endif
@@ -26,10 +26,25 @@ PyMethodDef ANN_methods[] = {
         METH_VARARGS, ""},
     {"pactivate", reinterpret_cast<PyCFunction>(pactivate),
         METH_VARARGS, ""},
+    {"from_arrays", reinterpret_cast<PyCFunction>(from_arrays),
+        METH_VARARGS | METH_KEYWORDS | METH_CLASS,
+        "Builds a network from packed arrays: from_arrays(inputs, biases, responses, types, "
+        "sources, targets, weights, sparse=1)."},
+    {"sactivate_batch", reinterpret_cast<PyCFunction>(sactivate_batch),
+        METH_VARARGS, "Serial activation of an (events x inputs) buffer of doubles (or floats) "
+        "into an (events x outputs) buffer of the same type."},
     {"flush", reinterpret_cast<PyCFunction>(flush),
         METH_NOARGS, ""},
+    {"set_threads", reinterpret_cast<PyCFunction>(set_threads),
+        METH_VARARGS, "Number of threads used by sactivate_batch."},
+    {"get_threads", reinterpret_cast<PyCFunction>(get_threads),
+        METH_NOARGS, ""},
+    {"get_num_outputs", reinterpret_cast<PyCFunction>(get_num_outputs),
+        METH_NOARGS, ""},
     {"set_logistic", reinterpret_cast<PyCFunction>(set_logistic),
         METH_VARARGS, ""},
+    {"use_fast_sigmoid", reinterpret_cast<PyCFunction>(use_fast_sigmoid),
+        METH_VARARGS, "Table based sigmoid (maximum error 3e-6 for exp and 6e-6 for tanh)."},
     {0}
 };
 
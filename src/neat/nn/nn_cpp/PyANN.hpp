@@ -6,6 +6,7 @@
 #define _PYANN_HPP_
 
 #include <Python.h>
+#include <cstring>
 //#include <vector>
 #include "ANN.h"
 
@@ -20,12 +21,13 @@ namespace {
 int ANN_init(ANNObject *self, PyObject *args, PyObject *kwds) {
     int inputs = 0;
     int neurons = 0;
-    static char *kwlist[] = {"inputs", "neurons", 0};
-    if (!PyArg_ParseTupleAndKeywords(args, kwds, "|ii", kwlist,
-            &inputs, &neurons)) {
+    int sparse = 0;
+    static char *kwlist[] = {"inputs", "neurons", "sparse", 0};
+    if (!PyArg_ParseTupleAndKeywords(args, kwds, "|iii", kwlist,
+            &inputs, &neurons, &sparse)) {
         return -1;
     }
-    self->ann = new ANN(inputs, neurons);
+    self->ann = new ANN(inputs, neurons, bool(sparse));
     return 0;
 }
 // destructor
@@ -111,6 +113,242 @@ PyObject* sactivate(ANNObject *self, PyObject *args) {
     return output;
 }
 
+// returns the type code of an object exporting an old style buffer
+// (array.array) and sets its item size; objects not telling the type of
+// their items are rejected (0 and a TypeError)
+char get_typecode(PyObject* object, Py_ssize_t* itemsize) {
+    PyObject* typecode = PyObject_GetAttrString(object, "typecode");
+    PyObject* size = typecode ? PyObject_GetAttrString(object, "itemsize") : 0;
+    char type = 0;
+    if (typecode && size && PyString_Check(typecode) && PyString_Size(typecode) == 1 &&
+        PyInt_Check(size)) {
+        type = PyString_AsString(typecode)[0];
+        *itemsize = PyInt_AsSsize_t(size);
+    }
+    Py_XDECREF(typecode);
+    Py_XDECREF(size);
+    if (!type) {
+        PyErr_Clear();
+        PyErr_SetString(PyExc_TypeError, "Expected an array (buffer with a known item type).");
+    }
+    return type;
+}
+
+// gets a C contiguous buffer of doubles or floats from any object
+// exporting the buffer interface (NumPy arrays, array.array('d'), ...)
+// and returns its type ('d' or 'f', 0 on error); old style buffers
+// must tell their type code (array.array)
+char get_real_buffer(PyObject* object, Py_buffer* view, bool writable) {
+    if (PyObject_CheckBuffer(object)) {
+        int flags = PyBUF_C_CONTIGUOUS | PyBUF_FORMAT;
+        if (writable) flags |= PyBUF_WRITABLE;
+        if (PyObject_GetBuffer(object, view, flags) < 0) {
+            return 0;
+        }
+        char type = view->format ? view->format[strlen(view->format)-1] : 'd';
+        if ((type == 'd' && view->itemsize == sizeof(double)) ||
+            (type == 'f' && view->itemsize == sizeof(float))) {
+            return type;
+        }
+        PyBuffer_Release(view);
+        PyErr_SetString(PyExc_TypeError, "Expected a buffer of doubles or floats.");
+        return 0;
+    }
+    // old style buffer interface (e.g. array.array)
+    Py_ssize_t itemsize;
+    char type = get_typecode(object, &itemsize);
+    if (!type) {
+        return 0;
+    }
+    if (!((type == 'd' && itemsize == sizeof(double)) ||
+          (type == 'f' && itemsize == sizeof(float)))) {
+        PyErr_SetString(PyExc_TypeError, "Expected a buffer of doubles or floats.");
+        return 0;
+    }
+    void* buffer;
+    Py_ssize_t length;
+    if (writable) {
+        if (PyObject_AsWriteBuffer(object, &buffer, &length) < 0) {
+            return 0;
+        }
+    }
+    else if (PyObject_AsReadBuffer(object, const_cast<const void**>(&buffer), &length) < 0) {
+        return 0;
+    }
+    if (length % itemsize != 0) {
+        PyErr_SetString(PyExc_TypeError, "Buffer length is not a multiple of its item size.");
+        return 0;
+    }
+    if (PyBuffer_FillInfo(view, object, buffer, length, !writable, PyBUF_SIMPLE) < 0) {
+        return 0;
+    }
+    return type;
+}
+
+// gets a C contiguous buffer of C ints (NumPy int32 arrays,
+// array.array('i'), ...); old style buffers must tell their type code
+bool get_int_buffer(PyObject* object, Py_buffer* view) {
+    if (PyObject_CheckBuffer(object)) {
+        if (PyObject_GetBuffer(object, view, PyBUF_C_CONTIGUOUS | PyBUF_FORMAT) < 0) {
+            return false;
+        }
+        char type = view->format ? view->format[strlen(view->format)-1] : 'i';
+        if ((type == 'i' || type == 'l') && view->itemsize == sizeof(int)) {
+            return true;
+        }
+        PyBuffer_Release(view);
+        PyErr_SetString(PyExc_TypeError, "Expected a buffer of ints.");
+        return false;
+    }
+    // old style buffer interface (e.g. array.array)
+    Py_ssize_t itemsize;
+    char type = get_typecode(object, &itemsize);
+    if (!type) {
+        return false;
+    }
+    if (!((type == 'i' || type == 'l') && itemsize == sizeof(int))) {
+        PyErr_SetString(PyExc_TypeError, "Expected a buffer of ints.");
+        return false;
+    }
+    const void* buffer;
+    Py_ssize_t length;
+    if (PyObject_AsReadBuffer(object, &buffer, &length) < 0) {
+        return false;
+    }
+    if (length % sizeof(int) != 0) {
+        PyErr_SetString(PyExc_TypeError, "Expected a buffer of ints.");
+        return false;
+    }
+    return PyBuffer_FillInfo(view, object, const_cast<void*>(buffer), length, 1, PyBUF_SIMPLE) == 0;
+}
+
+// builds a network in a single call from packed arrays: bias,
+// response and type (0 hidden, 1 output) of each neuron and the
+// source, target and weight of each connection (sources below
+// 'inputs' are sensors, the others neurons shifted by 'inputs')
+PyObject* from_arrays(PyObject *cls, PyObject *args, PyObject *kwds) {
+    int inputs, sparse = 1;
+    PyObject *biases, *responses, *types, *sources, *targets, *weights;
+    static char *kwlist[] = {"inputs", "biases", "responses", "types",
+                             "sources", "targets", "weights", "sparse", 0};
+    if (!PyArg_ParseTupleAndKeywords(args, kwds, "iOOOOOO|i", kwlist, &inputs,
+            &biases, &responses, &types, &sources, &targets, &weights, &sparse)) {
+        return 0;
+    }
+
+    // 0: biases, 1: responses, 2: weights, 3: types, 4: sources, 5: targets
+    PyObject* objects[6] = {biases, responses, weights, types, sources, targets};
+    Py_buffer views[6];
+    int ready = 0;
+    for (; ready < 6; ready++) {
+        if (ready < 3) {
+            if (get_real_buffer(objects[ready], &views[ready], false) != 'd') {
+                if (!PyErr_Occurred()) {
+                    PyBuffer_Release(&views[ready]);
+                    PyErr_SetString(PyExc_TypeError, "Expected a buffer of doubles.");
+                }
+                break;
+            }
+        }
+        else if (!get_int_buffer(objects[ready], &views[ready])) {
+            break;
+        }
+    }
+
+    PyObject* network = 0;
+    if (ready == 6) {
+        Py_ssize_t neurons = views[0].len/sizeof(double);
+        Py_ssize_t links = views[2].len/sizeof(double);
+        const int* from = static_cast<const int*>(views[4].buf);
+        const int* to = static_cast<const int*>(views[5].buf);
+        bool valid = views[1].len/Py_ssize_t(sizeof(double)) == neurons &&
+                     views[3].len/Py_ssize_t(sizeof(int)) == neurons &&
+                     views[4].len/Py_ssize_t(sizeof(int)) == links &&
+                     views[5].len/Py_ssize_t(sizeof(int)) == links;
+        for (Py_ssize_t k = 0; valid && k < links; k++) {
+            valid = from[k] >= 0 && from[k] < inputs + neurons && to[k] >= 0 && to[k] < neurons;
+        }
+        if (!valid) {
+            PyErr_SetString(PyExc_ValueError, "Inconsistent sizes or indexes of the arrays.");
+        }
+        else {
+            network = PyObject_CallFunction(cls, const_cast<char*>("iii"), inputs, int(neurons), sparse);
+        }
+        if (network) {
+            ANN* ann = reinterpret_cast<ANNObject*>(network)->ann;
+            ann->set_neurons(static_cast<const double*>(views[0].buf),
+                             static_cast<const double*>(views[1].buf),
+                             static_cast<const int*>(views[3].buf));
+            ann->set_links(int(links), from, to, static_cast<const double*>(views[2].buf));
+        }
+    }
+
+    for (int k = 0; k < ready; k++) {
+        PyBuffer_Release(&views[k]);
+    }
+    return network;
+}
+
+PyObject* sactivate_batch(ANNObject *self, PyObject *args) {
+    PyObject *inputs, *outputs;
+    if (!PyArg_ParseTuple(args, "OO", &inputs, &outputs)) {
+        return 0;
+    }
+    int sensors = self->ann->get_num_sensors();
+    int num_outputs = self->ann->get_num_outputs();
+    if (sensors == 0) {
+        PyErr_SetString(PyExc_ValueError, "Batch activation requires a network with inputs.");
+        return 0;
+    }
+
+    Py_buffer input_view, output_view;
+    char input_type = get_real_buffer(inputs, &input_view, false);
+    if (!input_type) {
+        return 0;
+    }
+    char output_type = get_real_buffer(outputs, &output_view, true);
+    if (!output_type) {
+        PyBuffer_Release(&input_view);
+        return 0;
+    }
+
+    bool ok = false;
+    Py_ssize_t item = input_type == 'd' ? sizeof(double) : sizeof(float);
+    Py_ssize_t values = input_view.len/item;
+    Py_ssize_t events = values/sensors;
+    if (input_type != output_type) {
+        PyErr_SetString(PyExc_TypeError, "Input and output buffers of different types.");
+    }
+    else if (values % sensors != 0 || (input_view.ndim == 2 && input_view.shape[1] != sensors)) {
+        PyErr_SetString(PyExc_ValueError, "Wrong number of inputs.");
+    }
+    else if (output_view.len/item != events*num_outputs) {
+        PyErr_SetString(PyExc_ValueError, "Wrong size of the output buffer.");
+    }
+    else {
+        // the buffers are held until released, so the interpreter can
+        // run other threads while the events are processed
+        ANN* ann = self->ann;
+        ann->prepare();
+        Py_BEGIN_ALLOW_THREADS
+        if (input_type == 'd')
+            ann->sactivate_batch(static_cast<const double*>(input_view.buf),
+                                 static_cast<double*>(output_view.buf), int(events));
+        else
+            ann->sactivate_batch(static_cast<const float*>(input_view.buf),
+                                 static_cast<float*>(output_view.buf), int(events));
+        Py_END_ALLOW_THREADS
+        ok = true;
+    }
+
+    PyBuffer_Release(&input_view);
+    PyBuffer_Release(&output_view);
+    if (!ok) {
+        return 0;
+    }
+    return Py_BuildValue("");
+}
+
 PyObject* pactivate(ANNObject *self, PyObject *args) {
     PyObject* list;
     if (!PyArg_ParseTuple(args, "O!", &PyList_Type, &list)) {
@@ -127,6 +365,32 @@ PyObject* flush(ANNObject* self) {
     return Py_BuildValue("");
 }
 
+PyObject* set_threads(ANNObject *self, PyObject *args) {
+    int threads;
+    if (!PyArg_ParseTuple(args, "i", &threads)) {
+        return 0;
+    }
+    self->ann->set_threads(threads);
+    return Py_BuildValue("");
+}
+
+PyObject* get_threads(ANNObject* self) {
+    return Py_BuildValue("i", self->ann->get_threads());
+}
+
+PyObject* get_num_outputs(ANNObject* self) {
+    return Py_BuildValue("i", self->ann->get_num_outputs());
+}
+
+PyObject* use_fast_sigmoid(ANNObject *self, PyObject *args) {
+    int option;
+    if (!PyArg_ParseTuple(args, "i", &option)) {
+        return 0;
+    }
+    self->ann->use_fast_sigmoid(bool(option));
+    return Py_BuildValue("");
+}
+
 PyObject* set_logistic(ANNObject *self, PyObject *args) {
     int option;
     if (!PyArg_ParseTuple(args, "i", &option)) {
@@ -4,5 +4,6 @@ setup(
       name='neat-python',      
       packages=['nn_cpp'],
       ext_modules=[               
-               Extension('ann', ['ANN.cpp', 'PyANN.cpp']),],
+               Extension('ann', ['ANN.cpp', 'PyANN.cpp'],
+                   extra_compile_args=['-fopenmp'], extra_link_args=['-fopenmp']),],
 )
@@ -0,0 +1,558 @@
+""" Vectorized evaluation of feedforward phenotypes.
+
+    A feedforward chromosome is turned into a level schedule: every
+    neuron is assigned to the first level where all its presynaptic
+    neurons are already known, so all the neurons of a level can be
+    computed at once for a whole (events x variables) matrix with a
+    couple of matrix products.
+
+    The activation types 'fast_exp' and 'fast_tanh' interpolate the
+    sigmoid from a table (as the C++ extension), with a maximum absolute
+    error of 3e-6 for exp and 6e-6 for tanh.
+
+    Networks are built in double precision by default; with
+    dtype=numpy.float32 the events and the network are evaluated in
+    single precision.
+
+    An ActivationCache keeps the activation of neurons over whole samples
+    so a mutated child only computes the neurons downstream of its
+    changed genes (see create_incremental_phenotype).
+"""
+from collections import OrderedDict
+
+try:
+    import numpy
+except ImportError:
+    print "NumPy library not found!"
+    raise
+
+def _table(function, lower, upper, points):
+    """ Returns (lower, upper, scale, values, slopes) of a tabulated function. """
+    scale = points/(upper - lower)
+    values = function(lower + numpy.arange(points + 1)/scale)
+    # the last point has no slope (upper end of the table)
+    return lower, upper, scale, values, numpy.append(numpy.diff(values), 0.0)
+
+# same tables as the C++ extension
+_logistic_table = _table(lambda x: 1.0/(1.0 + numpy.exp(-x)), -16.0, 16.0, 2048)
+_tanh_table = _table(numpy.tanh, -8.0, 8.0, 2048)
+
+def _interpolate(x, table):
+    """ Linear interpolation of a table applied in place to x. """
+    lower, upper, scale, values, slopes = table
+    numpy.clip(x, lower, upper, out=x)
+    x -= lower
+    x *= scale
+    index = x.astype(numpy.intp)
+    x -= index
+    x *= slopes.take(index)
+    x += values.take(index)
+    return x
+
+def sigmoid(x, response, logistic=True, fast=False):
+    """ Sigmoidal activation applied in place to the columns of x.
+        It follows the same saturation rules as the C++ extension.
+    """
+    if logistic:
+        low, high, lower, upper = -30.0, 30.0, 0.0, 1.0
+    else:
+        low, high, lower, upper = -20.0, 20.0, -1.0, 1.0
+    under = x < low
+    over = x > high
+    numpy.clip(x, low, high, out=x)
+    x *= response
+    if fast:
+        _interpolate(x, logistic and _logistic_table or _tanh_table)
+    elif logistic:
+        numpy.negative(x, out=x)
+        # large arguments (mostly in single precision) saturate to zero
+        with numpy.errstate(over='ignore'):
+            numpy.exp(x, out=x)
+        x += 1.0
+        numpy.reciprocal(x, out=x)
+    else:
+        numpy.tanh(x, out=x)
+    x[under] = lower
+    x[over] = upper
+    return x
+
+class FeedForward(object):
+    """ A feedforward network in matrix form evaluated level by level.
+
+        Neurons (hidden and output) are stored by level. Each event is
+        evaluated as if the network had been flushed before, i.e. links
+        coming from a neuron that is not activated before its target
+        in the serial order do not contribute.
+    """
+    def __init__(self, num_inputs, levels, biases, responses, sensory_weights, weights,
+                 outputs, logistic=True, fast=False):
+        self.__num_inputs = num_inputs
+        self.__levels = levels                    # [(first, last), ...] neuron ranges
+        self.__biases = biases
+        self.__responses = responses
+        self.__sensory_weights = sensory_weights  # inputs x neurons
+        self.__weights = weights                  # neurons x neurons
+        self.__outputs = outputs                  # neuron index of each output
+        self.__logistic = logistic
+        self.__fast = fast
+
+    num_inputs = property(lambda self: self.__num_inputs)
+    levels = property(lambda self: len(self.__levels))
+
+    def flush(self):
+        """ Nothing to flush: every event is evaluated from scratch. """
+        pass
+
+    def sactivate(self, inputs):
+        """ Serial activation of a single event (same interface as nn_cpp). """
+        return self.sactivate_batch([inputs])[0].tolist()
+
+    def sactivate_batch(self, inputs):
+        """ Activates the network for every row of an (events x inputs)
+            matrix and returns an (events x outputs) array.
+        """
+        inputs = numpy.asarray(inputs, dtype=self.__biases.dtype)
+        assert inputs.ndim == 2 and inputs.shape[1] == self.__num_inputs, "Wrong number of inputs."
+
+        # input contribution and bias of every neuron at once
+        state = numpy.dot(inputs, self.__sensory_weights)
+        state += self.__biases
+
+        for first, last in self.__levels:
+            if first > 0:
+                # signal coming from the neurons of the previous levels
+                state[:, first:last] += numpy.dot(state[:, :first], self.__weights[:first, first:last])
+            state[:, first:last] = sigmoid(state[:, first:last], self.__responses[first:last],
+                                           self.__logistic, self.__fast)
+
+        return state[:, self.__outputs]
+
+    def __repr__(self):
+        return '%d inputs, %d neurons in %d levels' \
+                % (self.__num_inputs, len(self.__biases), len(self.__levels))
+
+def _schedule(chromo):
+    """ Returns the neurons of a feedforward chromosome in serial order
+        (hidden nodes in node_order then output nodes), the level of
+        each neuron and the enabled links taking part in a flushed
+        serial activation as (source, target, weight) tuples.
+    """
+    num_inputs = chromo.sensors
+    num_outputs = chromo.actuators
+
+    serial = list(chromo.node_order) + \
+             [ng.id for ng in chromo.node_genes[num_inputs:num_inputs+num_outputs]]
+    position = dict((id, i) for i, id in enumerate(serial))
+
+    # incoming enabled links of every neuron
+    incoming = dict((id, []) for id in serial)
+    for cg in chromo.conn_genes:
+        if cg.enabled:
+            # links from neurons activated later read a flushed output
+            if cg.innodeid > num_inputs and position[cg.innodeid] >= position[cg.outnodeid]:
+                continue
+            incoming[cg.outnodeid].append((cg.innodeid, cg.outnodeid, cg.weight))
+
+    # level of every neuron (inputs are at level 0)
+    level = {}
+    links = []
+    for id in serial:
+        level[id] = 1
+        for link in incoming[id]:
+            if link[0] > num_inputs:
+                level[id] = max(level[id], level[link[0]] + 1)
+        links.extend(incoming[id])
+
+    return serial, level, links
+
+def _level_ranges(levels):
+    """ Returns the [first, last) ranges of a sorted list of levels. """
+    ranges = []
+    first = 0
+    for i in xrange(1, len(levels)+1):
+        if i == len(levels) or levels[i] != levels[first]:
+            ranges.append((first, i))
+            first = i
+    return ranges
+
+def _activation(activation_type, exact):
+    """ Returns the (logistic, fast) options of an activation type. """
+    return not activation_type.endswith('tanh'), \
+           activation_type.startswith('fast_') and not exact
+
+def create_ffphenotype(chromo, exact=False, dtype=numpy.float64):
+    """ Receives a feedforward chromosome and returns its phenotype
+        as a vectorized network (exact forces the exact sigmoid).
+    """
+    # dead and constant nodes are removed first
+    chromo = chromo.simplify(exact=exact)[0]
+    num_inputs = chromo.sensors
+    num_outputs = chromo.actuators
+    node_genes = chromo.node_genes
+
+    serial, level, links = _schedule(chromo)
+    position = dict((id, i) for i, id in enumerate(serial))
+
+    # neuron columns grouped by level keeping the serial order within a level
+    order = sorted(serial, key=lambda id: (level[id], position[id]))
+    column = dict((id, i) for i, id in enumerate(order))
+
+    size = len(order)
+    biases = numpy.array([node_genes[id-1].bias for id in order], dtype)
+    responses = numpy.array([node_genes[id-1].response for id in order], dtype)
+    sensory_weights = numpy.zeros((num_inputs, size), dtype)
+    weights = numpy.zeros((size, size), dtype)
+
+    for source, target, weight in links:
+        if source <= num_inputs:
+            sensory_weights[source-1, column[target]] = weight
+        else:
+            weights[column[source], column[target]] = weight
+
+    levels = _level_ranges([level[id] for id in order])
+    outputs = [column[id] for id in serial[len(serial)-num_outputs:]]
+    logistic, fast = _activation(node_genes[-1].activation_type, exact)
+
+    return FeedForward(num_inputs, levels, biases, responses, sensory_weights, weights,
+                       outputs, logistic, fast)
+
+class PopulationFeedForward(object):
+    """ All the feedforward networks of a population packed together.
+
+        The neurons of every genome are stored side by side, grouped by
+        level. The input links of the whole population form a single
+        (inputs x neurons) matrix and the links between neurons are kept
+        as a list per level, so each chunk of events is read only once
+        to evaluate every genome.
+    """
+    def __init__(self, num_inputs, levels, biases, responses, sensory_weights, links,
+                 outputs, logistic=True, chunk_size=None, fast=False):
+        self.__num_inputs = num_inputs
+        self.__levels = levels                    # [(first, last), ...] neuron ranges
+        self.__biases = biases
+        self.__responses = responses
+        self.__sensory_weights = sensory_weights  # inputs x neurons
+        self.__links = links                      # per level: (sources, weights, targets, starts)
+        self.__outputs = outputs                  # genomes x outputs neuron index
+        self.__logistic = logistic
+        self.__fast = fast
+
+        if chunk_size is None:
+            # keep the state of a chunk of events within a few MB
+            chunk_size = max(64, (1 << 22)/(biases.itemsize*(num_inputs + len(biases))))
+        self.chunk_size = chunk_size
+
+    num_inputs = property(lambda self: self.__num_inputs)
+
+    def __len__(self):
+        """ Returns the number of genomes """
+        return len(self.__outputs)
+
+    def __activate(self, inputs):
+        """ Returns the state of every neuron for a chunk of events. """
+        state = numpy.dot(inputs, self.__sensory_weights)
+        state += self.__biases
+
+        for (first, last), links in zip(self.__levels, self.__links):
+            if links is not None:
+                sources, weights, targets, starts = links
+                # signal coming from the neurons of the previous levels
+                signal = state[:, sources]
+                signal *= weights
+                state[:, targets] += numpy.add.reduceat(signal, starts, axis=1)
+            state[:, first:last] = sigmoid(state[:, first:last], self.__responses[first:last],
+                                           self.__logistic, self.__fast)
+        return state
+
+    def stream(self, inputs, chunk_size=None):
+        """ Iterates over the rows of an (events x inputs) matrix in chunks
+            and yields (first, last, outputs) where outputs is a
+            (genomes x events x outputs) array for the rows [first, last).
+        """
+        assert inputs.ndim == 2 and inputs.shape[1] == self.__num_inputs, "Wrong number of inputs."
+        if chunk_size is None:
+            chunk_size = self.chunk_size
+
+        for first in xrange(0, len(inputs), chunk_size):
+            last = min(first + chunk_size, len(inputs))
+            state = self.__activate(inputs[first:last])
+            yield first, last, state[:, self.__outputs].transpose(1, 0, 2)
+
+    def sactivate_batch(self, inputs):
+        """ Activates every network for every row of an (events x inputs)
+            matrix and returns a (genomes x events x outputs) array.
+        """
+        inputs = numpy.asarray(inputs, dtype=self.__biases.dtype)
+        result = numpy.empty((len(self), len(inputs), self.__outputs.shape[1]), inputs.dtype)
+        for first, last, outputs in self.stream(inputs):
+            result[:, first:last] = outputs
+        return result
+
+    def __repr__(self):
+        return '%d genomes, %d inputs, %d neurons in %d levels' \
+                % (len(self), self.__num_inputs, len(self.__biases), len(self.__levels))
+
+def create_population_phenotype(population, chunk_size=None, exact=False, dtype=numpy.float64):
+    """ Receives a population (or any list) of feedforward chromosomes
+        and returns all their phenotypes packed in a single network
+        (exact forces the exact sigmoid).
+    """
+    # dead and constant nodes are removed first
+    population = [chromo.simplify(exact=exact)[0] for chromo in population]
+    assert len(population) > 0, "Empty population."
+    num_inputs = population[0].sensors
+    num_outputs = population[0].actuators
+    activation_type = population[0].node_genes[-1].activation_type
+
+    # neurons of every genome as (level, genome, serial position, id)
+    neurons = []
+    genome_links = []
+    for g, chromo in enumerate(population):
+        assert chromo.sensors == num_inputs and chromo.actuators == num_outputs, \
+            "Genomes with different number of inputs or outputs."
+        assert chromo.node_genes[-1].activation_type == activation_type, \
+            "Genomes with different activation types."
+        serial, level, links = _schedule(chromo)
+        neurons.extend((level[id], g, i, id) for i, id in enumerate(serial))
+        genome_links.append(links)
+
+    neurons.sort()
+    column = dict(((g, id), i) for i, (l, g, p, id) in enumerate(neurons))
+    size = len(neurons)
+
+    biases = numpy.array([population[g].node_genes[id-1].bias for l, g, p, id in neurons], dtype)
+    responses = numpy.array([population[g].node_genes[id-1].response for l, g, p, id in neurons], dtype)
+    sensory_weights = numpy.zeros((num_inputs, size), dtype)
+
+    # links between neurons collected by the level of their target
+    level_of = [l for l, g, p, id in neurons]
+    hidden_links = {}
+    for g, links in enumerate(genome_links):
+        for source, target, weight in links:
+            if source <= num_inputs:
+                sensory_weights[source-1, column[g, target]] = weight
+            else:
+                target = column[g, target]
+                hidden_links.setdefault(level_of[target], []).append(
+                    (target, column[g, source], weight))
+
+    levels = _level_ranges(level_of)
+    links = []
+    for first, last in levels:
+        if level_of[first] not in hidden_links:
+            links.append(None)
+            continue
+        # links sorted by target so the signal can be summed by segments
+        level_links = sorted(hidden_links[level_of[first]])
+        targets = numpy.array(sorted(set(t for t, s, w in level_links)))
+        starts = numpy.searchsorted([t for t, s, w in level_links], targets)
+        links.append((numpy.array([s for t, s, w in level_links]),
+                      numpy.array([w for t, s, w in level_links], dtype),
+                      targets, starts))
+
+    outputs = numpy.array([[column[g, ng.id] for ng in
+                            chromo.node_genes[num_inputs:num_inputs+num_outputs]]
+                           for g, chromo in enumerate(population)])
+
+    logistic, fast = _activation(activation_type, exact)
+
+    return PopulationFeedForward(num_inputs, levels, biases, responses, sensory_weights, links,
+                                 outputs, logistic, chunk_size, fast)
+
+class ActivationCache(object):
+    """ Bounded cache of neuron activations over chunks of samples.
+
+        A neuron is identified by its content: bias, response and the
+        weighted links it receives, where a hidden source is itself a
+        neuron key (hash-consing). Neurons shared by a child and its
+        parents (or any genome seen before) get the same key, so only
+        the neurons downstream of changed genes are computed again.
+        Activations are kept per chunk of a sample and the least
+        recently used ones are dropped beyond max_bytes.
+    """
+    def __init__(self, max_bytes=256 << 20, max_keys=1 << 20, max_samples=2):
+        self.max_bytes = max_bytes
+        self.max_keys = max_keys
+        self.max_samples = max_samples
+        self.__keys = {}              # neuron content -> key
+        self.__values = OrderedDict() # (sample, key) -> activations
+        self.__samples = []           # [(fingerprint, inputs, sample), ...]
+        self.__next_sample = 0
+        self.__next_key = 0
+        self.__bytes = 0
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        """ Returns the number of activations kept """
+        return len(self.__values)
+
+    nbytes = property(lambda self: self.__bytes)
+
+    def clear(self):
+        self.__keys.clear()
+        self.__values.clear()
+        self.__bytes = 0
+
+    def __sample(self, inputs, options):
+        """ Returns the index of a sample (the inputs are kept alive so
+            their memory cannot be reused by another sample).
+        """
+        interface = inputs.__array_interface__
+        fingerprint = (interface['data'][0], inputs.shape, inputs.strides,
+                       inputs.dtype.str, options)
+        for stored, kept, sample in self.__samples:
+            if stored == fingerprint:
+                return sample
+        if len(self.__samples) >= self.max_samples:
+            dropped = self.__samples.pop(0)[2]
+            for key in [key for key in self.__values if key[0][0] == dropped]:
+                self.__bytes -= self.__values.pop(key).nbytes
+        sample = self.__next_sample
+        self.__next_sample += 1
+        self.__samples.append((fingerprint, inputs, sample))
+        return sample
+
+    def __key(self, content):
+        """ Returns the key of a neuron content (hash-consing). """
+        key = self.__keys.get(content)
+        if key is None:
+            if len(self.__keys) >= self.max_keys:
+                # keys are never reused, so contents built with the
+                # keys being dropped cannot match a new neuron
+                self.clear()
+            key = self.__keys[content] = self.__next_key
+            self.__next_key += 1
+        return key
+
+    def __store(self, key, value):
+        self.__values[key] = value
+        self.__bytes += value.nbytes
+        while self.__bytes > self.max_bytes and len(self.__values) > 1:
+            self.__bytes -= self.__values.popitem(last=False)[1].nbytes
+
+    def neurons(self, chromo):
+        """ Returns the neurons of a simplified feedforward chromosome in
+            serial order as (key, bias, response, links) tuples, where the
+            links are (source, weight) pairs with the inputs as negative
+            sources (-1 is the first one) and hidden sources as keys.
+        """
+        num_inputs = chromo.sensors
+        node_genes = chromo.node_genes
+        serial, level, links = _schedule(chromo)
+
+        incoming = dict((id, []) for id in serial)
+        for source, target, weight in links:
+            incoming[target].append((source, weight))
+
+        keys = {}
+        neurons = []
+        for id in serial:
+            # inputs as negative keys
+            content = tuple(sorted((source <= num_inputs and -source or keys[source], weight)
+                                   for source, weight in incoming[id]))
+            ng = node_genes[id-1]
+            key = keys[id] = self.__key((ng.bias, ng.response, content))
+            neurons.append((key, ng.bias, ng.response, content))
+        return neurons
+
+    def activate(self, chromo, inputs, logistic=True, fast=False, first=0, last=None, neurons=None):
+        """ Activates a simplified feedforward chromosome for the rows
+            first:last of an (events x inputs) array and returns an
+            (outputs x events) array computing only the neurons not found
+            in the cache (neurons as returned by neurons(chromo)).
+        """
+        if last is None:
+            last = len(inputs)
+        if neurons is None:
+            neurons = self.neurons(chromo)
+        sample = (self.__sample(inputs, (logistic, fast)), first, last)
+        rows = inputs[first:last]
+
+        state = {}
+        for key, bias, response, links in neurons:
+            value = self.__values.pop((sample, key), None)
+            if value is None:
+                self.misses += 1
+                value = numpy.empty(len(rows), inputs.dtype)
+                value.fill(bias)
+                sensors = [(-source-1, weight) for source, weight in links if source < 0]
+                if sensors:
+                    value += numpy.dot(rows[:, [s for s, w in sensors]],
+                                       numpy.array([w for s, w in sensors], inputs.dtype))
+                for source, weight in links:
+                    if source >= 0:
+                        value += inputs.dtype.type(weight)*state[source]
+                sigmoid(value, inputs.dtype.type(response), logistic, fast)
+                self.__store((sample, key), value)
+            else:
+                self.hits += 1
+                self.__values[sample, key] = value
+            state[key] = value
+
+        return numpy.array([state[key] for key, bias, response, links in
+                            neurons[len(neurons)-chromo.actuators:]])
+
+class IncrementalPopulationFeedForward(object):
+    """ The feedforward networks of a population evaluated one genome at
+        a time over each chunk of events, reusing the neuron activations kept
+        in an ActivationCache (same interface as PopulationFeedForward).
+    """
+    def __init__(self, population, cache, logistic=True, fast=False, chunk_size=None):
+        self.__population = population
+        self.__cache = cache
+        self.__logistic = logistic
+        self.__fast = fast
+        self.chunk_size = chunk_size
+
+    num_inputs = property(lambda self: self.__population[0].sensors)
+
+    def __len__(self):
+        """ Returns the number of genomes """
+        return len(self.__population)
+
+    def stream(self, inputs, chunk_size=None):
+        """ Yields (first, last, outputs) as PopulationFeedForward.stream,
+            each chunk of events being activated when it is requested.
+        """
+        assert inputs.ndim == 2 and inputs.shape[1] == self.num_inputs, "Wrong number of inputs."
+        if chunk_size is None:
+            chunk_size = self.chunk_size
+        if chunk_size is None:
+            # about 4MB of outputs per chunk
+            num_outputs = self.__population[0].actuators
+            chunk_size = max(64, (1 << 22)/(inputs.itemsize*len(self)*num_outputs))
+
+        # neuron keys computed once for all the chunks
+        neurons = [self.__cache.neurons(chromo) for chromo in self.__population]
+        for first in xrange(0, len(inputs), chunk_size):
+            last = min(first + chunk_size, len(inputs))
+            outputs = numpy.array([self.__cache.activate(chromo, inputs, self.__logistic, self.__fast,
+                                                         first, last, chromo_neurons)
+                                   for chromo, chromo_neurons in zip(self.__population, neurons)])
+            yield first, last, outputs.transpose(0, 2, 1)
+
+    def sactivate_batch(self, inputs):
+        """ Activates every network for every row of an (events x inputs)
+            matrix and returns a (genomes x events x outputs) array.
+        """
+        inputs = numpy.asarray(inputs)
+        return numpy.concatenate([outputs for first, last, outputs in self.stream(inputs)], 1)
+
+    def __repr__(self):
+        return '%d genomes evaluated incrementally (%d activations cached)' \
+                % (len(self), len(self.__cache))
+
+def create_incremental_phenotype(population, cache, exact=False):
+    """ Receives a population (or any list) of feedforward chromosomes and
+        returns their phenotypes evaluated through an ActivationCache (the
+        precision is the one of the inputs).
+    """
+    population = [chromo.simplify(exact=exact)[0] for chromo in population]
+    assert len(population) > 0, "Empty population."
+    activation_type = population[0].node_genes[-1].activation_type
+    for chromo in population:
+        assert chromo.node_genes[-1].activation_type == activation_type, \
+            "Genomes with different activation types."
+    logistic, fast = _activation(activation_type, exact)
+    return IncrementalPopulationFeedForward(population, cache, logistic, fast)
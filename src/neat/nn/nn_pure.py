@@ -6,11 +6,44 @@ try:
 except ImportError:
     pass
 
+def _table(function, lower, upper, points):
+    " Tabulates a function in [lower, upper] (same tables as nn_cpp) "
+    scale = points/(upper - lower)
+    return lower, upper, scale, [function(lower + k/scale) for k in xrange(points + 1)]
+
+_logistic_table = _table(lambda x: 1.0/(1.0 + math.exp(-x)), -16.0, 16.0, 2048)
+_tanh_table = _table(math.tanh, -8.0, 8.0, 2048)
+
+def _interpolate(x, table):
+    " Linear interpolation of a tabulated function "
+    lower, upper, scale, values = table
+    if x <= lower: return values[0]
+    if x >= upper: return values[-1]
+    position = (x - lower)*scale
+    k = int(position)
+    return values[k] + (position - k)*(values[k+1] - values[k])
+
+def _fast_exp(x, response):
+    " Logistic function interpolated from a table (maximum error 3e-6) "
+    if x < - 30: return 0.0
+    elif x > 30: return 1.0
+    else: return _interpolate(x*response, _logistic_table)
+
+def _fast_tanh(x, response):
+    " Hyperbolic tangent interpolated from a table (maximum error 6e-6) "
+    if x < - 20: return -1.0
+    elif x > 20: return +1.0
+    else: return _interpolate(x*response, _tanh_table)
+
 def sigmoid(x, response, activation_type):
     " Sigmoidal type of activation function "
     output = 0
     try:
-        if activation_type == 'exp':
+        if activation_type == 'fast_exp':
+            output = _fast_exp(x, response)
+        elif activation_type == 'fast_tanh':
+            output = _fast_tanh(x, response)
+        elif activation_type == 'exp':
             if x < - 30: output = 0.0
             elif x > 30: output = 1.0
             else: output = 1.0/(1.0 + math.exp(-x*response))
@@ -28,6 +61,33 @@ def sigmoid(x, response, activation_type):
 
     return output
 
+def _exp(x, response):
+    if x < - 30: return 0.0
+    elif x > 30: return 1.0
+    else: return 1.0/(1.0 + math.exp(-x*response))
+
+def _tanh(x, response):
+    if x < - 20: return -1.0
+    elif x > 20: return +1.0
+    else: return math.tanh(x*response)
+
+# activation function of each activation type
+activation_functions = {'exp': _exp, 'tanh': _tanh, 'fast_exp': _fast_exp, 'fast_tanh': _fast_tanh}
+
+def activation_function(activation_type, exact=False):
+    " Returns the activation function used by the C++ and NumPy networks "
+    if exact:
+        activation_type = exact_activation(activation_type)
+    if activation_type.endswith('tanh'):
+        return activation_type.startswith('fast_') and _fast_tanh or _tanh
+    return activation_type.startswith('fast_') and _fast_exp or _exp
+
+def exact_activation(activation_type):
+    " Returns the activation type without the table interpolation "
+    if activation_type is not None and activation_type.startswith('fast_'):
+        return activation_type[len('fast_'):]
+    return activation_type
+
 class Neuron(object):
     " A simple sigmoidal neuron "
     __id = 0
@@ -42,6 +102,9 @@ class Neuron(object):
         assert(self._type in ('INPUT', 'OUTPUT', 'HIDDEN'))
 
         self._activation_type = activation_type # default is exponential
+        # the activation function is chosen once (unknown types go through sigmoid)
+        self._sigmoid = activation_functions.get(activation_type,
+                            lambda x, response: sigmoid(x, response, activation_type))
 
         self._response = response # default = 4.924273 (Stanley, p. 146)
         self._output = 0.0  # for recurrent networks all neurons must have an "initial state"
@@ -60,7 +123,7 @@ class Neuron(object):
     def activate(self):
         "Activates the neuron"
         assert self._type is not 'INPUT'
-        return sigmoid(self._update_activation() + self._bias, self._response, self._activation_type)
+        return self._sigmoid(self._update_activation() + self._bias, self._response)
 
     def _update_activation(self):
         soma = 0.0
@@ -233,13 +296,13 @@ class FeedForward(Network):
                 for o in self.neurons[-self.__output_layer:]:
                         self.add_synapse(Synapse(h, o, r(-1,1)))
 
-def create_phenotype(chromo):
+def create_phenotype(chromo, exact=False):
         """ Receives a chromosome and returns its phenotype (a neural network) """
 
         neurons_list = [Neuron(ng._type, ng._id,
                                ng._bias,
                                ng._response,
-                               ng.activation_type)
+                               exact_activation(ng.activation_type) if exact else ng.activation_type)
                         for ng in chromo._node_genes]
 
         conn_list = [(cg.innodeid, cg.outnodeid, cg.weight)
@@ -247,8 +310,14 @@ def create_phenotype(chromo):
 
         return Network(neurons_list, conn_list, chromo.sensors)
 
-def create_ffphenotype(chromo):
+def create_ffphenotype(chromo, exact=False):
     """ Receives a chromosome and returns its phenotype (a neural network) """
+    # dead and constant nodes are removed first
+    chromo = chromo.simplify(exact=exact)[0]
+    if exact:
+        activation = exact_activation
+    else:
+        activation = lambda activation_type: activation_type
 
     # first create inputs
     neurons_list = [Neuron('INPUT', ng.id, 0, 0) \
@@ -259,10 +328,10 @@ def create_ffphenotype(chromo):
         neurons_list.append(Neuron('HIDDEN',
                                    id, chromo.node_genes[id-1].bias,
                                    chromo.node_genes[id-1].response,
-                                   chromo.node_genes[id-1].activation_type))
+                                   activation(chromo.node_genes[id-1].activation_type)))
     # finally the output
     neurons_list.extend(Neuron('OUTPUT', ng.id, ng.bias,
-                               ng.response, ng.activation_type) \
+                               ng.response, activation(ng.activation_type)) \
                                for ng in chromo.node_genes if ng.type == 'OUTPUT')
 
     assert(len(neurons_list) == len(chromo.node_genes))
@@ -272,6 +341,86 @@ def create_ffphenotype(chromo):
 
     return Network(neurons_list, conn_list, chromo.sensors)
 
+class CompiledFeedForward(object):
+    """ A feedforward phenotype compiled into a python function: sactivate
+        is the function itself, so scoring an event is a single call.
+    """
+    def __init__(self, function, source, num_inputs):
+        self.sactivate = function
+        self.source = source # python code of the function
+        self._num_inputs = num_inputs
+
+    def flush(self):
+        """ Nothing to flush: every event is evaluated from scratch. """
+        pass
+
+    def __repr__(self):
+        return 'compiled network with %d inputs' % self._num_inputs
+
+# compiled phenotypes by chromosome signature (cleared when full)
+_compiled = {}
+_compiled_size = 1000
+
+def _sigmoid_code(x, response, activation_type):
+    " Returns the code of the activation of the variable x "
+    if activation_type == 'exp':
+        return '0.0 if %s < -30 else 1.0 if %s > 30 else 1.0/(1.0 + exp(-%s*%r))' \
+                % (x, x, x, response)
+    elif activation_type == 'tanh':
+        return '-1.0 if %s < -20 else 1.0 if %s > 20 else tanh(%s*%r)' \
+                % (x, x, x, response)
+    elif activation_type in ('fast_exp', 'fast_tanh'):
+        return '_%s(%s, %r)' % (activation_type, x, response)
+    else:
+        return '_sigmoid(%s, %r, %r)' % (x, response, activation_type)
+
+def _compile_ffphenotype(chromo, exact):
+    " Writes and compiles the activation function of a feedforward chromosome "
+    # only enabled links from earlier neurons reaching an output are left
+    chromo = chromo.simplify(exact=exact)[0]
+    num_inputs = chromo.sensors
+    node_genes = chromo.node_genes
+    outputs = [ng.id for ng in node_genes[num_inputs:num_inputs+chromo.actuators]]
+
+    # neurons in activation order and their incoming links
+    serial = list(chromo.node_order) + outputs
+    incoming = dict((id, []) for id in serial)
+    for cg in chromo.conn_genes:
+        incoming[cg.outnodeid].append((cg.innodeid, cg.weight))
+
+    name = lambda id: id > num_inputs and 'n%d' % id or 'i%d' % id
+    lines = ['def activate(inputs):']
+    if num_inputs > 0:
+        lines.append('    %s, = inputs' % ', '.join(name(id) for id in xrange(1, num_inputs+1)))
+    for id in serial:
+        ng = node_genes[id-1]
+        # same summation order as the Neuron class
+        terms = ['%r*%s' % (weight, name(source)) for source, weight in incoming[id]]
+        lines.append('    x = %s' % ' + '.join(terms + [repr(ng.bias)]))
+        activation_type = exact and exact_activation(ng.activation_type) or ng.activation_type
+        lines.append('    %s = %s' % (name(id), _sigmoid_code('x', ng.response, activation_type)))
+    lines.append('    return [%s]' % ', '.join(name(id) for id in outputs))
+    source = '\n'.join(lines) + '\n'
+
+    namespace = {'exp': math.exp, 'tanh': math.tanh, '_sigmoid': sigmoid,
+                 '_fast_exp': _fast_exp, '_fast_tanh': _fast_tanh}
+    exec compile(source, '<chromosome %d>' % chromo.id, 'exec') in namespace
+    return CompiledFeedForward(namespace['activate'], source, num_inputs)
+
+def compile_ffphenotype(chromo, exact=False):
+    """ Receives a feedforward chromosome and returns its phenotype compiled
+        into a straight-line python function (constants inlined and dead
+        neurons removed). Each event is evaluated as in a flushed network.
+        Compiled phenotypes are cached by chromosome signature.
+    """
+    key = (chromo.signature(), exact)
+    network = _compiled.get(key)
+    if network is None:
+        if len(_compiled) >= _compiled_size:
+            _compiled.clear()
+        network = _compiled[key] = _compile_ffphenotype(chromo, exact)
+    return network
+
 if __name__ == "__main__":
     # Example
     #from neat import visualize
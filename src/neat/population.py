@@ -6,13 +6,96 @@ import cPickle as pickle
 from config import Config
 import species
 import chromosome
+import genome
+import checkpoint
+
+try:
+    import numpy
+except ImportError:
+    numpy = None # speciation falls back to Chromosome.distance
+
+class Compatibility(object):
+    """ Vectorized compatibility distance between a list of chromosomes
+        and any other chromosome (same values as Chromosome.distance).
+        The innovation sorted genes of all the chromosomes are packed in
+        flat arrays so a whole column of distances takes a few array
+        operations.
+    """
+    def __init__(self, chromosomes):
+        genes = [c.compact_genes() for c in chromosomes]
+        self.__sizes = numpy.array([len(innovs) for innovs, weights in genes], int)
+        self.__owners = numpy.repeat(numpy.arange(len(genes)), self.__sizes)
+        self.__innovs = numpy.fromiter((i for innovs, weights in genes for i in innovs),
+                                       int, self.__sizes.sum())
+        self.__weights = numpy.fromiter((w for innovs, weights in genes for w in weights),
+                                        float, self.__sizes.sum())
+        # last innovation of each chromosome (-1 if it has no genes)
+        self.__lasts = numpy.array([innovs and innovs[-1] or -1 for innovs, weights in genes], int)
+
+    def __len__(self):
+        return len(self.__sizes)
+
+    def distances(self, other, indexes=None):
+        """ Returns the distances between the chromosomes (all of them or
+            those of a sorted array of indexes) and the other.
+        """
+        innovs, weights = other.compact_genes()
+        innovs = numpy.array(innovs, int)
+        weights = numpy.array(weights, float)
+        size = len(innovs)
+        last = size and innovs[-1] or -1
+
+        sizes, owners, genes, gene_weights, lasts = \
+            self.__sizes, self.__owners, self.__innovs, self.__weights, self.__lasts
+        if indexes is not None:
+            # genes of the selected chromosomes (owners renumbered)
+            selected = numpy.zeros(len(sizes), bool)
+            selected[indexes] = True
+            selected = selected[owners]
+            sizes, lasts = sizes[indexes], lasts[indexes]
+            owners = numpy.searchsorted(indexes, self.__owners[selected])
+            genes, gene_weights = genes[selected], gene_weights[selected]
+        count = len(sizes)
+
+        # homologous genes
+        if size:
+            position = numpy.searchsorted(innovs, genes).clip(0, size-1)
+            homologous = innovs[position] == genes
+            differences = numpy.fabs(gene_weights - weights[position])
+        else:
+            homologous = numpy.zeros(len(genes), bool)
+            differences = numpy.zeros(len(genes))
+        matching = numpy.bincount(owners, homologous, count)
+        weight_diff = numpy.bincount(owners, numpy.where(homologous, differences, 0.), count)
+
+        # genes of the longest chromosome after the last innovation of the other
+        excess = numpy.where(sizes > size,
+                             numpy.bincount(owners, genes > last, count),
+                             size - numpy.searchsorted(innovs, lasts, 'right'))
+        disjoint = sizes + size - 2*matching - excess
+
+        distance = Config.excess_coeficient * excess + \
+                   Config.disjoint_coeficient * disjoint
+        distance += numpy.where(matching > 0,
+                                Config.weight_coeficient * (weight_diff/numpy.maximum(matching, 1)), 0.)
+        return distance
 
 class Population(object):
     """ Manages all the species  """
-    evaluate = None # Evaluates the entire population. You need to override
-                    # this method in your experiments
+    evaluate = None # Evaluates a list of individuals (those of the population
+                    # not evaluated yet). You need to override this method
+                    # in your experiments
+
+    # numpy generator for the bulk draws of the vectorized mutation (created
+    # when first needed, seeded from the given seed or from random)
+    __seed = None
+    __generator = None
+    # innovation numbers of the population's links (see genome.InnovationRegistry)
+    __innovations = None
+    # writes the (binary) checkpoints, not saved in them
+    __checkpoints = None
 
-    def __init__(self, checkpoint_file=None):
+    def __init__(self, checkpoint_file=None, seed=None):
 
         if checkpoint_file:
             # start from a previous point: creates an 'empty'
@@ -30,20 +113,54 @@ class Population(object):
             self.__avg_fitness = []
             self.__best_fitness = []
 
+            self.__seed = seed
+            self.__innovations = genome.InnovationRegistry(Config.innovation_policy)
             self.__create_population()
             self.__generation = -1
 
     stats = property(lambda self: (self.__best_fitness, self.__avg_fitness))
     species_log = property(lambda self: self.__species_log)
 
-    def __resume_checkpoint(self, checkpoint):
+    @property
+    def generator(self):
+        """ The population's numpy RandomState (saved in the checkpoints) """
+        if self.__generator is None:
+            seed = self.__seed
+            if seed is None:
+                seed = random.getrandbits(32)
+            self.__generator = numpy.random.RandomState(seed)
+        return self.__generator
+
+    @property
+    def innovations(self):
+        """ The population's innovation registry (saved in the checkpoints) """
+        if self.__innovations is None:
+            # checkpoints from before the registries
+            self.__innovations = genome.InnovationRegistry(Config.innovation_policy)
+            self.__innovations.register(self.__population)
+        return self.__innovations
+
+    def __resume_checkpoint(self, checkpoint_file):
         """ Resumes the simulation from a previous saved point. """
+        if checkpoint.is_checkpoint(checkpoint_file):
+            print 'Resuming from a previous point: %s' %checkpoint_file
+            self.__dict__, rstate = checkpoint.load(checkpoint_file)
+            random.setstate(rstate)
+            # chromosome and species id counters (class attributes)
+            ids, species_id = self.__dict__.pop('_Population__ids', ({}, None))
+            for cls, id in ids.iteritems():
+                cls._id = id
+            if species_id is not None:
+                species.Species._Species__id = species_id
+            return
+
+        # pickled checkpoints (older releases)
         try:
-            #file = open(checkpoint)
-            file = gzip.open(checkpoint)
+            #file = open(checkpoint_file)
+            file = gzip.open(checkpoint_file)
         except IOError:
             raise
-        print 'Resuming from a previous point: %s' %checkpoint
+        print 'Resuming from a previous point: %s' %checkpoint_file
         # when unpickling __init__ is not called again
         previous_pop = pickle.load(file)
         self.__dict__ = previous_pop.__dict__
@@ -54,22 +171,31 @@ class Population(object):
         #random.jumpahead(1)
         file.close()
 
-    def __create_checkpoint(self, report):
-        """ Saves the current simulation state. """
+    def __create_checkpoint(self, report, deltas=0, background=False):
+        """ Saves the current simulation state (binary checkpoint, a delta
+            of the last full one if deltas are due), written by a background
+            thread if asked to.
+        """
         #from time import strftime
         # get current time
         #date = strftime("%Y_%m_%d_%Hh%Mm%Ss")
         if report:
             print 'Creating checkpoint file at generation: %d' %self.__generation
 
-        # dumps 'self'
-        #file = open('checkpoint_'+str(self.__generation), 'w')
-        file = gzip.open('checkpoint_'+str(self.__generation), 'w', compresslevel = 5)
-        # dumps the population
-        pickle.dump(self, file, protocol=2)
-        # dumps the current random state
-        pickle.dump(random.getstate(), file, protocol=2)
-        file.close()
+        if self.__checkpoints is None:
+            self.__checkpoints = checkpoint.Writer()
+        # dumps the population (and its numpy random state) and the current random state
+        state = dict(self.__dict__)
+        del state['_Population__checkpoints']
+        state['_Population__ids'] = (dict((cls, cls._id) for cls in set(c.__class__ for c in self.__population)),
+                                     species.Species._Species__id)
+        self.__checkpoints.write('checkpoint_'+str(self.__generation), state,
+                                 random.getstate(), deltas, background)
+
+    def flush_checkpoints(self):
+        """ Waits for the checkpoint being written in background. """
+        if self.__checkpoints is not None:
+            self.__checkpoints.wait()
 
     def __create_population(self):
 
@@ -80,11 +206,11 @@ class Population(object):
 
         self.__population = []
         for i in xrange(self.__popsize):
-            g = genotypes.create_fully_connected() \
+            g = genotypes.create_fully_connected(self.__innovations) \
                 if Config.fully_connected \
-                else genotypes.create_minimally_connected()
+                else genotypes.create_minimally_connected(self.__innovations)
             if Config.hidden_nodes > 0:
-                g.add_hidden_nodes(Config.hidden_nodes)
+                g.add_hidden_nodes(Config.hidden_nodes, self.__innovations)
             self.__population.append(g)
 
     def __repr__(self):
@@ -106,19 +232,29 @@ class Population(object):
     #    self.__population.remove(chromo)
 
     def __speciate(self, report):
-        """ Group chromosomes into species by similarity """
-        # Speciate the population
-        for individual in self:
-            found = False
-            for s in self.__species:
-                if individual.distance(s.representant) < Config.compatibility_threshold:
-                    s.add(individual)
-                    found = True
-                    break
+        """ Group chromosomes into species by similarity: each individual
+            joins the first species whose representant (the one chosen
+            before speciating or the founder of a new species) is compatible.
+        """
+        representants = [s.representant for s in self.__species]
+        if numpy is None:
+            assignment = self.__assign_species(representants)
+        else:
+            assignment = self.__assign_species_vectorized(representants)
 
-            if not found: # create a new species for this lone chromosome
+        # Speciate the population (new species are founded in order)
+        for individual, k in zip(self.__population, assignment):
+            if k < len(self.__species):
+                self.__species[k].add(individual)
+            else: # create a new species for this lone chromosome
                 self.__species.append(species.Species(individual))
 
+        # members of each species in population order (the species
+        # lists are reset when reproducing)
+        self.__members = {}
+        for individual in self.__population:
+            self.__members.setdefault(individual.species_id, []).append(individual)
+
         # python technical note:
         # we need a "working copy" list when removing elements while looping
         # otherwise we might end up having sync issues
@@ -132,6 +268,56 @@ class Population(object):
 
         self.__set_compatibility_threshold()
 
+    def __assign_species(self, representants):
+        """ Returns the index of the species of every individual (new
+            species are numbered after the existing ones).
+        """
+        representants = list(representants)
+        assignment = []
+        for individual in self.__population:
+            for k, representant in enumerate(representants):
+                if individual.distance(representant) < Config.compatibility_threshold:
+                    break
+            else:
+                k = len(representants)
+                representants.append(individual)
+            assignment.append(k)
+        return assignment
+
+    def __assign_species_vectorized(self, representants):
+        """ Same as __assign_species, computing at once the distances of
+            the individuals without species to each representant.
+        """
+        pool = Compatibility(self.__population)
+        assignment = numpy.empty(len(pool), int)
+        unassigned = numpy.arange(len(pool))
+        k = 0
+        while len(unassigned):
+            if k < len(representants):
+                representant = representants[k]
+            else:
+                # the first lone individual founds a new species
+                representant = self.__population[unassigned[0]]
+                assignment[unassigned[0]] = k
+                unassigned = unassigned[1:]
+            compatible = pool.distances(representant, unassigned) < Config.compatibility_threshold
+            assignment[unassigned[compatible]] = k
+            unassigned = unassigned[~compatible]
+            k += 1
+        return assignment.tolist()
+
+    def __remove_species(self, s):
+        """ Removes a species and its members from the index (the
+            population is updated by __remove_members).
+        """
+        self.__species.remove(s)
+        del self.__members[s.id]
+
+    def __remove_members(self):
+        """ Removes from the population the members of removed species """
+        if len(self.__population) > sum([len(m) for m in self.__members.itervalues()]):
+            self.__population = [c for c in self.__population if c.species_id in self.__members]
+
     def __set_compatibility_threshold(self):
         ''' Controls compatibility threshold '''
         if len(self.__species) > Config.species_size:
@@ -142,6 +328,35 @@ class Population(object):
             else:
                 print 'Compatibility threshold cannot be changed (minimum value has been reached)'
 
+    def __evaluate(self, evaluated, report):
+        """ Evaluates the individuals with an unknown fitness. Elites keep
+            their fitness and individuals identical to one evaluated in
+            the previous generation (clones) reuse it. Returns the fitness
+            of the current population by chromosome signature.
+        """
+        signatures = [c.signature() for c in self.__population]
+
+        # individuals to evaluate grouped by signature (clones are evaluated once)
+        pending = {}
+        for c, signature in zip(self.__population, signatures):
+            if c.fitness is None:
+                c.fitness = evaluated.get(signature)
+            if c.fitness is None:
+                pending.setdefault(signature, []).append(c)
+
+        if report:
+            print 'Evaluating %d out of %d individuals' %(len(pending), len(self))
+
+        if pending:
+            # evaluate is usually a plain function attached to the class
+            evaluate = getattr(self.evaluate, 'im_func', self.evaluate)
+            evaluate([clones[0] for clones in pending.itervalues()])
+            for clones in pending.itervalues():
+                for c in clones[1:]:
+                    c.fitness = clones[0].fitness
+
+        return dict(zip(signatures, [c.fitness for c in self.__population]))
+
     def average_fitness(self):
         """ Returns the average raw fitness of population """
         sum = 0.0
@@ -235,7 +450,7 @@ class Population(object):
         return (num_nodes/total, num_conns/total, avg_weights/total)
 
     def epoch(self, n, report=True, save_best=False, checkpoint_interval = 10,
-        checkpoint_generation = None):
+        checkpoint_generation = None, checkpoint_deltas = 0, checkpoint_background = False):
         """ Runs NEAT's genetic algorithm for n epochs.
 
             Keyword arguments:
@@ -244,16 +459,23 @@ class Population(object):
             checkpoint_interval -- time in minutes between saving checkpoints (default 10 minutes)
             checkpoint_generation -- time in generations between saving checkpoints
                 (default 0 -- option disabled)
+            checkpoint_deltas -- delta checkpoints (only the chromosomes changed since
+                the last full checkpoint) written between full ones (default 0)
+            checkpoint_background -- write the checkpoints in a background thread while
+                evolution goes on (default False)
         """
         t0 = time.time() # for saving checkpoints
+        evaluated = {}   # previous generation's fitness by chromosome signature
+        # new links get their innovations from this population
+        innovations = self.innovations
 
         for g in xrange(n):
             self.__generation += 1
 
             if report: print '\n ****** Running generation %d ****** \n' % self.__generation
 
-            # Evaluate individuals
-            self.evaluate()
+            # Evaluate individuals (only those not evaluated before)
+            evaluated = self.__evaluate(evaluated, report)
             # Speciates the population
             self.__speciate(report)
 
@@ -295,13 +517,8 @@ class Population(object):
                         if report:
                             print "\n   Species %2d (with %2d individuals) is stagnated: removing it" \
                                     %(s.id, len(s))
-                        # removing species
-                        self.__species.remove(s)
-                        # removing all the species' members
-                        #TODO: can be optimized!
-                        for c in self.__population[:]:
-                            if c.species_id == s.id:
-                                self.__population.remove(c)
+                        # removing species and its members
+                        self.__remove_species(s)
 
             # Remove "super-stagnated" species (even if it has the best chromosome)
             # It is not clear if it really avoids local minima
@@ -310,13 +527,8 @@ class Population(object):
                     if report:
                         print "\n   Species %2d (with %2d individuals) is super-stagnated: removing it" \
                                 %(s.id, len(s))
-                    # removing species
-                    self.__species.remove(s)
-                    # removing all the species' members
-                    #TODO: can be optimized!
-                    for c in self.__population[:]:
-                        if c.species_id == s.id:
-                            self.__population.remove(c)
+                    # removing species and its members
+                    self.__remove_species(s)
 
             # Compute spawn levels for each remaining species
             self.__compute_spawn_levels()
@@ -327,11 +539,10 @@ class Population(object):
                 if s.spawn_amount == 0:
                     if report:
                         print '   Species %2d age %2s removed: produced no offspring' %(s.id, s.age)
-                    for c in self.__population[:]:
-                        if c.species_id == s.id:
-                            self.__population.remove(c)
-                                #self.remove(c)
-                    self.__species.remove(s)
+                    self.__remove_species(s)
+
+            # Removing the members of the removed species (single pass)
+            self.__remove_members()
 
             # Logging speciation stats
             self.__log_species()
@@ -356,10 +567,18 @@ class Population(object):
 
             # -------------------------- Producing new offspring -------------------------- #
             new_population = [] # next generation's population
+            innovations.new_generation(self.__population)
 
             # Spawning new population
+            pending = generator = None
+            if Config.vectorized_mutation:
+                pending = []
+                generator = self.generator
             for s in self.__species:
-                new_population.extend(s.reproduce())
+                new_population.extend(s.reproduce(pending, generator, innovations))
+            if pending:
+                # mutates all the children at once
+                chromosome.mutate_all(pending, generator, innovations)
 
             # ----------------------------#
             # Controls under or overflow  #
@@ -379,18 +598,15 @@ class Population(object):
                 while fill > 0:
                     # Selects a random chromosome from population
                     parent1 = random.choice(self.__population)
-                    # Search for a mate within the same species
-                    found = False
-                    for c in self:
+                    # Search for a mate within the same species (the first one)
+                    mates = self.__members.get(parent1.species_id)
+                    if mates:
                         # what if c is parent1 itself?
-                        if c.species_id == parent1.species_id:
-                            child = parent1.crossover(c)
-                            new_population.append(child.mutate())
-                            found = True
-                            break
-                    if not found:
+                        child = parent1.crossover(mates[0])
+                        new_population.append(child.mutate(innovations))
+                    else:
                         # If no mate was found, just mutate it
-                        new_population.append(parent1.mutate())
+                        new_population.append(parent1.mutate(innovations))
                     #new_population.append(chromosome.FFChromosome.create_fully_connected())
                     fill -= 1
 
@@ -399,10 +615,13 @@ class Population(object):
             self.__population = new_population[:]
 
             if checkpoint_interval is not None and time.time() > t0 + 60*checkpoint_interval:
-                self.__create_checkpoint(report)
+                self.__create_checkpoint(report, checkpoint_deltas, checkpoint_background)
                 t0 = time.time() # updates the counter
             elif checkpoint_generation is not None and self.__generation % checkpoint_generation == 0:
-                self.__create_checkpoint(report)
+                self.__create_checkpoint(report, checkpoint_deltas, checkpoint_background)
+
+        # the last checkpoint is complete when returning
+        self.flush_checkpoints()
 
 if __name__ ==  '__main__' :
     
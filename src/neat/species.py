@@ -83,8 +83,13 @@ class Species(object):
 
             return current
 
-    def reproduce(self):
-        """ Returns a list of 'spawn_amount' new individuals """
+    def reproduce(self, pending=None, generator=None, innovations=None):
+        """ Returns a list of 'spawn_amount' new individuals. When a
+            pending list is given the children are not mutated but
+            appended to it (to be mutated later all at once). A numpy
+            RandomState generator is used for the crossover draws and
+            the innovations registry numbers the new links.
+        """
 
         offspring = [] # new offspring for this species
         self.__age += 1  # increment species age
@@ -124,14 +129,18 @@ class Species(object):
                 parent2 = self.TournamentSelection()
 
                 assert parent1.species_id == parent2.species_id, "Parents has different species id."
-                child = parent1.crossover(parent2)
-                offspring.append(child.mutate())
+                child = parent1.crossover(parent2, generator)
             else:
                 # mutate only
                 parent1 = self.__subpopulation[0]
                 # TODO: temporary hack - the child needs a new id (not the father's)
-                child = parent1.crossover(parent1)
-                offspring.append(child.mutate())
+                child = parent1.crossover(parent1, generator)
+
+            if pending is None:
+                offspring.append(child.mutate(innovations))
+            else:
+                offspring.append(child)
+                pending.append(child)
 
         # reset species (new members will be added again when speciating)
         self.__subpopulation = []
@@ -13,7 +13,8 @@ setup(
                    extra_compile_args=['-Wno-write-strings'],
                    library_dirs=[sys.prefix + "/lib"]),
                Extension('src/neat/nn/ann', ['src/neat/nn/nn_cpp/ANN.cpp', 'src/neat/nn/nn_cpp/PyANN.cpp'], 
-                   extra_compile_args=['-Wno-write-strings'],
+                   extra_compile_args=['-Wno-write-strings', '-fopenmp'],
+                   extra_link_args=['-fopenmp'],
                    library_dirs=[sys.prefix + "/lib"]),
                Extension('src/neat/ifnn/ifnn_cpp', ['src/neat/ifnn/ifnn.cpp'], 
                    extra_compile_args=['-Wno-write-strings'],
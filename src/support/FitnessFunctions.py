@@ -8,9 +8,12 @@
 # Descrition:
 #   Implements the different fitness functions for neat
 
+import math, numpy
+
 from ROOT import Math
 
-from neat.nn import nn_cpp as nn
+from neat.config import Config
+from neat.nn import nn_numpy as nn
 
 
 ## Base class for a fitness function
@@ -18,6 +21,13 @@ class FitnessFunction(object):
 
   #3 Constructor and variable initialization 
   def __init__(self, args):
+    # Exact sigmoid even for table based activation types
+    setDefault(args, 'exact', False)
+    # Incremental evaluation reusing the neuron activations of previous 
+    # genomes (parents) kept in a cache of the given size (MB)
+    setDefault(args, 'incremental', False)
+    setDefault(args, 'cacheSize', 256)
+    self.cache = None
     for arg in args:
       setattr(self, arg, args[arg])
 
@@ -29,6 +39,37 @@ class FitnessFunction(object):
   def message(self, msg):
     print '%s: %s' % (self.__class__.__name__, msg)
 
+  ## Get all the nn described by the chromosomes (feed foreward) in the
+  ## precision of the sample (double or single), evaluated incrementally 
+  ## when requested (only for nets streamed over whole samples)
+  def phenotypes(self, population, sample, incremental = None):
+    if incremental is None: incremental = self.incremental
+    if incremental:
+      if self.cache is None:
+        self.cache = nn.ActivationCache(max_bytes = int(self.cacheSize*(1 << 20)))
+      return nn.create_incremental_phenotype(population, self.cache, exact = self.exact)
+    dtype = getattr(sample, 'dtype', numpy.float64)
+    return nn.create_population_phenotype(population, exact = self.exact, dtype = dtype)
+
+  ## Iterate over the sample in chunks returning the event weights 
+  ## (always in double) and the output of all the nets (genomes x events)
+  def stream(self, nets, sample):
+    sample = numpy.asarray(sample)
+    for first, last, outputs in nets.stream(sample[:,1:]):
+      yield numpy.asarray(sample[first:last,0], numpy.float64), outputs[:,:,0]
+
+  ## Weighted histograms of the net outputs (genomes x bins) with the 
+  ## binning of a TH1 in [0,1) (bin 0 and nbins+1 are under and overflow)
+  def histograms(self, nets, sample, nbins):
+    contents = numpy.zeros(len(nets)*(nbins+2))
+    offsets = (nbins+2)*numpy.arange(len(nets)).reshape(-1,1)
+    for weights, outputs in self.stream(nets, sample):
+      bins = numpy.floor(outputs*nbins).astype(int) + 1
+      numpy.clip(bins, 0, nbins+1, out=bins)
+      bins += offsets
+      contents += numpy.bincount(bins.ravel(), numpy.tile(weights, len(nets)), len(contents))
+    return contents.reshape(len(nets), nbins+2)
+
 
 def setDefault(args, arg, value):
   if not arg in args: args[arg] = value 
@@ -41,44 +82,145 @@ class EventEuclideanDistance(FitnessFunction):
   def __init__(self, **args):
     # Default values
     setDefault(args, 'norm', 2.)
+    # Racing mode (early rejection of the worst genomes)
+    setDefault(args, 'racing', False)
+    setDefault(args, 'quantile', 0.5)
+    setDefault(args, 'confidence', 0.95)
+    setDefault(args, 'stages', 4)
+    setDefault(args, 'seed', 0)
     # Call the constructor from parent class
     super(EventEuclideanDistance,self).__init__(args)
 
 
   # Implementation
   def __call__(self, population, signalYield, signalSample, backgroundYield, backgroundSample):
+    if self.racing:
+      return self.race(population, signalYield, signalSample, backgroundYield, backgroundSample)
+    # Get all the nn described by the chromosomes (feed foreward)
+    nets = self.phenotypes(population, signalSample)
+    # Computing the error of each net over the signal events
+    error = numpy.zeros(len(nets))
+    for weights, outputs in self.stream(nets, signalSample):
+      error = error + numpy.dot((1 - outputs)**self.norm, weights)/signalYield
+    # Computing the error of each net over the background events
+    for weights, outputs in self.stream(nets, backgroundSample):
+      error = error + numpy.dot(outputs**self.norm, weights)/backgroundYield
+
     # Loop over the chromosomes in the population 
-    for genome in population:
-  
-      # Get a nn describe by the chromosome (feed foreward)
-      net = nn.create_ffphenotype(genome)   
-      error = 0.0
-      # Loop over the events
-      for event in signalSample:
-        # Extract variables and weight
-        variables = event[1:]
-        weight = event[0]/signalYield
-        # Not strictly necessary in feedforward nets
-        net.flush()
-        # Computing the error
-        error = error + weight*(1 - net.sactivate(variables)[0])**self.norm
-
-      # Loop over the events
-      for event in backgroundSample:
-        # Extract variables and weight
-        variables = event[1:]
-        weight = event[0]/backgroundYield
-        # Not strictly necessary in feedforward nets
-        net.flush()
-        # Computing the error
-        error = error + weight*(net.sactivate(variables)[0])**self.norm
-    
+    for genome, genomeError in zip(population, error):
       # Set the fitness value to the chomosome
-      genome.fitness = 1 - Math.pow(error/2, 1./self.norm)
+      genome.fitness = 1 - Math.pow(genomeError/2, 1./self.norm)
+
+
+  ## Racing evaluation: the genomes are evaluated over growing subsets of 
+  ## events and a genome is rejected when its fitness upper bound (Hoeffding) 
+  ## is below the given quantile of the fitness lower bounds of all the 
+  ## genomes still racing. Rejected genomes get their fitness lower bound.
+  ## The errors of each stage are added by evaluate(genomes, stage, error) 
+  ## so the stages can be split in blocks while the quantile is computed 
+  ## once over the whole population.
+  def race(self, population, signalYield, signalSample, backgroundYield, backgroundSample, evaluate = None):
+    population = list(population)
+    if evaluate is None:
+      evaluate = lambda genomes, stage, error: \
+        self.raceErrors(genomes, stage, error, signalSample, backgroundSample)
+    # Maximum error of an event (outputs in [0,1] or [-1,1])
+    scale = 1.
+    if Config.nn_activation.endswith('tanh'):
+      scale = 2.**self.norm
+    # Hoeffding deviation factor (union bound over stages and samples)
+    factor = scale*math.sqrt(math.log(4.*self.stages/(1 - self.confidence))/2)
+
+    samples = self.raceSamples(signalSample, backgroundSample)
+
+    active = numpy.arange(len(population))
+    fitness = numpy.zeros(len(population))
+    error = numpy.zeros((len(population), 2))
+    weights = numpy.zeros(2)
+    squares = numpy.zeros(2)
+
+    for stage in xrange(self.stages):
+      # Adding the error over the new events of each sample
+      error[active] = evaluate([population[g] for g in active], stage, error[active])
+      for index, (sample, bounds) in enumerate(samples):
+        eventWeights = numpy.asarray(sample[bounds[stage]:bounds[stage+1],0], numpy.float64)
+        weights[index] += eventWeights.sum()
+        squares[index] += (eventWeights**2).sum()
+
+      # Exact fitness when using all the events
+      if stage == self.stages-1:
+        total = error[active,0]/signalYield + error[active,1]/backgroundYield
+        fitness[active] = 1 - numpy.power(total/2, 1./self.norm)
+        break
+      # Waiting for events in both samples
+      if squares.min() <= 0: continue
+
+      # Error bounds using the effective number of events
+      total = (error[active]/weights).sum(1)
+      deviation = (factor*numpy.sqrt(squares)/weights).sum()
+      upper = 1 - numpy.power(numpy.clip(total - deviation, 0, None)/2, 1./self.norm)
+      lower = 1 - numpy.power((total + deviation)/2, 1./self.norm)
+
+      # Rejecting those that cannot reach the quantile
+      rejected = upper < numpy.percentile(lower, 100.*self.quantile)
+      fitness[active[rejected]] = lower[rejected]
+      active = active[~rejected]
+
+    self.message('%d out of %d genomes evaluated over all the events' % (len(active), len(population)))
+
+    for genome, genomeFitness in zip(population, fitness):
+      genome.fitness = float(genomeFitness)
+
+
+  ## Adds to the error of the genomes (genomes x samples) the error over 
+  ## the events of the given racing stage
+  def raceErrors(self, genomes, stage, error, signalSample, backgroundSample):
+    error = numpy.array(error, numpy.float64)
+    nets = self.phenotypes(genomes, signalSample, incremental = False)
+    for index, (sample, bounds) in enumerate(self.raceSamples(signalSample, backgroundSample)):
+      events = sample[bounds[stage]:bounds[stage+1]]
+      for eventWeights, outputs in self.stream(nets, events):
+        if index == 0: outputs = 1 - outputs
+        error[:, index] += numpy.dot(outputs**self.norm, eventWeights)
+    return error
+
+
+  ## Stratified signal and background samples with the range of events of 
+  ## each stage (kept for the samples of the last call)
+  def raceSamples(self, signalSample, backgroundSample):
+    key = (signalSample, backgroundSample)
+    cached = getattr(self, '_raceSamples', None)
+    if cached is None or cached[0][0] is not key[0] or cached[0][1] is not key[1]:
+      generator = numpy.random.RandomState(self.seed)
+      samples = []
+      for sample in key:
+        sample = numpy.asarray(sample)
+        order, bounds = self.stratify(sample[:,0], generator)
+        samples.append((sample[order], bounds))
+      cached = self._raceSamples = (key, samples)
+    return cached[1]
+
+
+  ## Weight stratified order of the events: events sorted by weight are 
+  ## grouped in strata of 2**(stages-1) and the events of every stage take 
+  ## the same number of events (randomly chosen) from each stratum. 
+  ## Returns the order and the range of events of each stage.
+  def stratify(self, weights, generator):
+    size = 2**(self.stages-1)
+    rank = numpy.empty(len(weights), int)
+    rank[numpy.argsort(weights, kind='mergesort')] = numpy.arange(len(weights))
+    stratum = rank/size
+    # Random position of each event within its stratum
+    position = numpy.empty(len(weights), int)
+    position[numpy.lexsort((generator.random_sample(len(weights)), stratum))] = \
+      numpy.arange(len(weights)) % size
+    order = numpy.lexsort((stratum, position))
+    bounds = numpy.searchsorted(position[order], [0] + [2**k for k in xrange(self.stages)])
+    return order, bounds
     
 
-import random, math
-from ROOT import Math, TH1F, TRandom3
+import random
+from ROOT import Math, TRandom3
 
 
 ## SchwienhorstEllerMetric was developed withing BDT and NEAT
@@ -95,53 +237,21 @@ class SchwienhorstEllerMetric(FitnessFunction):
   # Implementation
   def __call__(self, population, signalYield, signalSample, backgroundYield, backgroundSample):
 
-    # Histogram holders
-    signalHistogram = TH1F('signalHistogram', 'signal', self.nbins, 0, 1)
-    backgroundHistogram = TH1F('backgroundHistogram', 'background', self.nbins, 0, 1)
+    # Get all the nn described by the chromosomes (feed foreward)
+    nets = self.phenotypes(population, signalSample)
+
+    # Histograms of the net output for each chromosome (without under and overflows)
+    signalHistograms = self.histograms(nets, signalSample, self.nbins)[:,1:-1]
+    backgroundHistograms = self.histograms(nets, backgroundSample, self.nbins)[:,1:-1]
 
     # Loop over the chromosomes in the population 
-    for genome in population:
-  
-      # Reset histograms
-      signalHistogram.Reset()
-      backgroundHistogram.Reset()
-
-      # Get a nn describe by the chromosome (feed foreward)
-      net = nn.create_ffphenotype(genome)   
-
-      # Loop over the events creating signal histogram
-      for event in signalSample:
-        # Extract variables and weight
-        variables = event[1:]
-        weight = event[0]
-        # Not strictly necessary in feedforward nets
-        net.flush()
-        # Net output
-        output = net.sactivate(variables)[0]
-        # Filling histograms
-        signalHistogram.Fill(output, weight)
-            
-      # Loop over the events creating background histogram
-      for event in backgroundSample:
-        # Extract variables and weight
-        variables = event[1:]
-        weight = event[0]
-        # Not strictly necessary in feedforward nets
-        net.flush()
-        # Net output
-        output = net.sactivate(variables)[0]
-        # Filling histograms
-        backgroundHistogram.Fill(output, weight)
-    
-      fitness = 0
-  
-      # Computing fitness
-      for bin in xrange(1,signalHistogram.GetNbinsX()+1):
-        signal = signalHistogram.GetBinContent(bin)
-        background = backgroundHistogram.GetBinContent(bin)
-        total = signal + background
-        if total > 0:
-          fitness = fitness + signal**2/(signal+background)
+    for genome, signal, background in zip(population, signalHistograms, backgroundHistograms):
+
+      # Computing fitness (using only bins with entries)
+      total = signal + background
+      signal = signal[total > 0]
+      total = total[total > 0]
+      fitness = numpy.sum(signal**2/total)
 
       # Adding fitness to genome
       genome.fitness = Math.sqrt(fitness)
@@ -167,49 +277,19 @@ class ZScore(FitnessFunction):
   # Implementation
   def __call__(self, population, signalYield, signalSample, backgroundYield, backgroundSample):
 
-    # Histogram holders
-    signalHistogram = TH1F('signalHistogram', 'signal', self.nbins, 0, 1)
-    backgroundHistogram = TH1F('backgroundHistogram', 'background', self.nbins, 0, 1)
+    # Get all the nn described by the chromosomes (feed foreward)
+    nets = self.phenotypes(population, signalSample)
+
+    # Histograms of the net output for each chromosome
+    signalHistograms = self.histograms(nets, signalSample, self.nbins)
+    backgroundHistograms = self.histograms(nets, backgroundSample, self.nbins)
+
+    # Signal and background overall normalization scale
+    signalScale = signalYield/len(signalSample)
+    backgroundScale = backgroundYield/len(backgroundSample)
 
     # Loop over the chromosomes in the population 
-    for genome in population:
-  
-      # Reset histograms
-      signalHistogram.Reset()
-      backgroundHistogram.Reset()
-
-      # Get a nn describe by the chromosome (feed foreward)
-      net = nn.create_ffphenotype(genome)   
-
-      # Loop over the events creating signal histogram
-      for event in signalSample:
-        # Extract variables and weight
-        variables = event[1:]
-        weight = event[0]
-        # Not strictly necessary in feedforward nets
-        net.flush()
-        # Net output
-        output = net.sactivate(variables)[0]
-        # Filling histograms
-        signalHistogram.Fill(output, weight)
-
-      # Signal overall normalization scale
-      signalScale = signalYield/len(signalSample)
-            
-      # Loop over the events creating background histogram
-      for event in backgroundSample:
-        # Extract variables and weight
-        variables = event[1:]
-        weight = event[0]
-        # Not strictly necessary in feedforward nets
-        net.flush()
-        # Net output
-        output = net.sactivate(variables)[0]
-        # Filling histograms
-        backgroundHistogram.Fill(output, weight)
-
-      # Background overall normalization scale
-      backgroundScale = backgroundYield/len(backgroundSample)
+    for genome, signalHistogram, backgroundHistogram in zip(population, signalHistograms, backgroundHistograms):
   
       # Random generators
       rcount = TRandom3(int(random.uniform(0,65535)))
@@ -219,7 +299,7 @@ class ZScore(FitnessFunction):
       zscore = 0.; sqweight = 0.
   
       # Computing weighted z-score
-      for bin in xrange(1,signalHistogram.GetNbinsX()+1):
+      for bin in xrange(1,self.nbins+1):
 
         newz = 0.; oldz = 0.
 
@@ -227,13 +307,13 @@ class ZScore(FitnessFunction):
         for point in xrange(1,self.mpoints+1):
           # Sample background
           background = Math.gamma_quantile(rbackground.Uniform(), 
-            (backgroundHistogram.GetBinContent(bin)/backgroundScale)+1., backgroundScale
+            (backgroundHistogram[bin]/backgroundScale)+1., backgroundScale
           )
           # Background larger that zero
           if background > 0.:
             # Sampling signal
             signal = Math.gamma_quantile(rsignal.Uniform(),
-              (signalHistogram.GetBinContent(bin)/signalScale)+1., signalScale
+              (signalHistogram[bin]/signalScale)+1., signalScale
             )
             # Sampling count
             count = rcount.Poisson(signal+background)
@@ -253,7 +333,7 @@ class ZScore(FitnessFunction):
             if point == self.mpoints:
               self.message('Warning reach maximum number of integration %s points.' % point)
 
-        weight = self.weight(signalHistogram.GetBinCenter(bin))
+        weight = self.weight((bin - 0.5)/self.nbins)
         zscore = zscore + weight * newz
         sqweight = sqweight + weight**2
         
@@ -18,6 +18,8 @@ sys.argv.append('-b')
 import cPickle as pickle
 from optparse import OptionParser
 
+import numpy
+
 from neat.nn import nn_cpp as nn
 
 from TopovarWriter import *
@@ -40,6 +42,7 @@ if __name__ == "__main__":
   parser.add_option('-i', '--input', dest='input', help='Input topovar file.')
   parser.add_option('-o', '--output', dest='output', help='Output topovar file.')
   parser.add_option('-b', '--batch', action='store_true', dest='list', default=True, help='Set ROOT batch mode (default true).')
+  parser.add_option('-t', '--threads', dest='threads', type='int', default=1, help='Number of threads activating the nets (default 1).')
   
   (options, args) = parser.parse_args()
   
@@ -52,6 +55,7 @@ if __name__ == "__main__":
   # Collection of neat nn
   nets = {}
   variables = {}
+  used = {}
   normalizers = {}
     
   # Loop over the inputs
@@ -79,17 +83,21 @@ if __name__ == "__main__":
     # Get channel winner network
     winner = pickle.load(open('%s/winner.info' % indir))
     
-    # Collect the list of variables
-    variables[key] = winner['variables']
-    
-    # Collect the net
+    # Collect the net (without the inputs it does not use)
     net = pickle.load(open('%s/%s/winner.dat' % (indir, winner['training'])))
+    net, inputs = net.simplify(prune_inputs = True, exact = True)
+
+    # Collect the list of variables (and those read by the net)
+    variables[key] = winner['variables']
+    used[key] = [winner['variables'][i] for i in inputs]
+    message('Net %s uses %d out of %d variables' % (key, len(inputs), len(winner['variables'])))
 
     # Create phenotype from genome
-    nets[key] = nn.create_ffphenotype(net)
+    nets[key] = nn.create_ffphenotype(net, exact = True)
+    nets[key].set_threads(options.threads)
 
     # Creating a variable normalizers
-    normalizers[key] = VariableNormalizer(winner['variables'], winner['aves'], winner['stds'])
+    normalizers[key] = VariableNormalizer(used[key], winner['aves'], winner['stds'])
 
   # Create a topowriter for adding neat outputs
   topovars = None
@@ -102,22 +110,30 @@ if __name__ == "__main__":
   for key in nets:
     topovars.addVariable(key, 'double')
 
-  # Loop over the tree adding the neat output        
-  for entry in xrange(topovars.getInTreeEntries()):
-    if entry % 1000 == 0 and entry != 0:
-      message('Reading %d events.' % entry)
+  # Loop over the tree in blocks of events adding the neat output        
+  entries = topovars.getInTreeEntries()
+  for first in xrange(0, entries, 1000):
+    last = min(first + 1000, entries)
+    if first != 0:
+      message('Reading %d events.' % first)
     # Collection of neat discriminator
     neats = {}
     # Loop over all the nets  
     for key in nets:
-      # Read one event and normalize
-      event = topovars.read(entry, compress = True, variables = variables[key])
-      normalizers[key].normalize(event)
-      # Not strictly necessary in feedforward nets
-      nets[key].flush()
-      neats[key] = nets[key].sactivate(event[1:])[0]
-    # Add to the tree
-    topovars.fill(neats)
+      # Read the block of events and normalize
+      events = []
+      for entry in xrange(first, last):
+        event = topovars.read(entry, compress = True, variables = used[key])
+        normalizers[key].normalize(event)
+        events.append(event[1:])
+      # Activate the net for all the events (threads run without the GIL)
+      outputs = numpy.empty((last - first, nets[key].get_num_outputs()))
+      nets[key].sactivate_batch(numpy.array(events), outputs)
+      neats[key] = outputs[:,0]
+    # Add to the tree (reloading each event, the out tree fills from the in tree buffers)
+    for i in xrange(last - first):
+      topovars.load(first + i)
+      topovars.fill(dict((key, neats[key][i]) for key in nets))
   # Write the events into the file
   topovars.write()
  
@@ -10,6 +10,8 @@
 
 import copy, math, os, random, sys
 
+import numpy
+
 from ROOT import TChain
 from ROOT import TFile
 
@@ -90,14 +92,21 @@ class TopovarReader(object):
   
   
   ## Return a list with the content of the whole sample
-  def sample(self, compress = False):
+  ## (an events x variables array of the given dtype if provided)
+  def sample(self, compress = False, dtype = None):
     self.__message('Reading the whole sample in one step.')
-    sample = []
+    if dtype:
+      sample = numpy.empty((self.getEntries(), len(self.__variables)), dtype)
+    else:
+      sample = []
     for entry in xrange(self.getEntries()):
       # Print number of event processed
       if entry % 5000 == 0 and entry != 0:
         self.__message('Reading %d events.' % entry)
-      sample.append(self.read(entry, compress))
+      if dtype:
+        sample[entry] = self.read(entry, True)
+      else:
+        sample.append(self.read(entry, compress))
     return sample 
 
 
@@ -114,6 +114,18 @@ class TopovarWriter(object):
         setattr(event, variable, getattr(self.__intree, variable))
       return event
 
+
+  ## Load an entry of the in tree without reading it
+  ## (the cloned out tree branches share the in tree buffers)
+  def load(self, entry):
+    # Check for the intree exist
+    if not self.__intree:
+      raise TopovarWriterError('No input tree exist.')
+    # Check if the entry is in the chain
+    if entry < 0 or entry >= self.__intree.GetEntries():
+      raise TopovarWriterError('Entry out of range of the in tree.')
+    self.__intree.GetEntry(entry)
+
     
   ## Add a new topovar to the tree
   def addVariable(self, variable, type, default = -999):
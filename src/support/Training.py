@@ -10,9 +10,13 @@
 #   Implemantation of neat training
 
 
-import string, time
+import copy, string, time
 import cPickle as pickle
 
+from multiprocessing import Pool, current_process
+
+import numpy
+
 from neat import config, population, chromosome, genome #, visualize
 
 from TopovarReader import *
@@ -28,10 +32,13 @@ signalSample = None
 backgroundYield = None
 backgroundSample = None
 
+# Pool of workers for the fitness evaluation
+pool = None
+
   
 ## Main fuction
 def Evaluate(set):
-  global signalYield, signalSample, backgroundYield, backgroundSample
+  global signalYield, signalSample, backgroundYield, backgroundSample, pool
 
   # Reading variable list
   variables = open('%s/inputvars.txt' % set['directory']).readlines()
@@ -63,8 +70,14 @@ def Evaluate(set):
   # Creating a variable normalizer
   normalizer = VariableNormalizer(variables)
 
+  # Events are stored as arrays (in single precision if requested)
+  dtype = numpy.float64
+  if getattr(Common, 'NeatSinglePrecision', False):
+    print 'Training: Using single precision for the samples and the networks'
+    dtype = numpy.float32
+
   # Saving the population in buffer
-  signalSample = signals.sample(compress = True)
+  signalSample = signals.sample(compress = True, dtype = dtype)
   
   # Adding the sample to the normalizer
   normalizer.add(signalSample)
@@ -85,7 +98,7 @@ def Evaluate(set):
     )
 
   # Saving the population in buffer
-  backgroundSample = backgrounds.sample(compress = True)
+  backgroundSample = backgrounds.sample(compress = True, dtype = dtype)
 
   # Adding the sample to the normalizer
   normalizer.add(backgroundSample)
@@ -103,9 +116,30 @@ def Evaluate(set):
   # NEAT training
   chromosome.node_gene_type = genome.NodeGene  
   population.Population.evaluate = FitnessFunctionWrapper
-  pop = population.Population()
-  pop.epoch(int(set['number_generations']), report=True, save_best=False, checkpoint_interval = None)
+
+  # Workers are forked after loading the samples so they share them read-only 
+  # (daemonic processes like the ones of a Processor cannot have children)
+  processes = int(getattr(Common, 'NeatFitnessProcesses', 1))
+  if processes > 1 and not current_process().daemon:
+    print 'Training: Evaluating the fitness with %d processes' % processes
+    pool = Pool(processes = processes)
+
+  try:
+    pop = population.Population()
+    pop.epoch(int(set['number_generations']), report=True, save_best=False, checkpoint_interval = None)
+  finally:
+    if pool:
+      pool.terminate(); pool.join()
+      pool = None
+
   winner = pop.stats[0][-1]
+
+  # Score the winner with the exact sigmoid when evolving with the tables
+  if config.Config.nn_activation.startswith('fast_'):
+    fitness = copy.copy(Common.NeatFitnessFunction)
+    fitness.exact = True
+    fitness([winner], signalYield, signalSample, backgroundYield, backgroundSample)
+
   print 'Training: Number of evaluations: %d' % winner.id
   print 'Training: Best NN fitness: %0.2f' % winner.fitness
 
@@ -124,10 +158,57 @@ def FitnessFunctionWrapper(population):
   global signalYield, signalSample, backgroundYield, backgroundSample
   print 'FitnessFunctionWrapper: Evaluating the population fitness ...'
   start = time.time()
-  Common.NeatFitnessFunction(population, signalYield, signalSample, backgroundYield, backgroundSample)
+  population = list(population)
+  # Racing compares each genome against the whole population, the race 
+  # runs here and only the errors of each stage are evaluated in blocks
+  if getattr(Common.NeatFitnessFunction, 'racing', False):
+    Common.NeatFitnessFunction.race(
+      population, signalYield, signalSample, backgroundYield, backgroundSample, RaceStageWrapper
+    )
+  else:
+    # The population is evaluated in blocks of a fixed size so the serial
+    # and parallel evaluations compute exactly the same fitness values
+    blocks = FitnessFunctionBlocks(population)
+    fitnesses = FitnessFunctionMap(FitnessFunctionWorker, blocks)
+    for block, fitness in zip(blocks, fitnesses):
+      for chromo, value in zip(block, fitness):
+        chromo.fitness = value
   print 'FitnessFunctionWrapper: Evaluation complete in %0.1f minutes.' % ((time.time() - start)/60)
 
 
+# Splits a sequence in blocks of the fitness block size
+def FitnessFunctionBlocks(sequence):
+  size = int(getattr(Common, 'NeatFitnessBlockSize', 20))
+  return [sequence[i:i+size] for i in xrange(0, len(sequence), size)]
+
+
+# Maps a worker over the blocks (with the pool of workers if any)
+def FitnessFunctionMap(worker, blocks):
+  if pool:
+    return pool.map(worker, blocks, chunksize = 1)
+  return map(worker, blocks)
+
+
+# Evaluates a block of chromosomes and returns their fitness
+def FitnessFunctionWorker(block):
+  global signalYield, signalSample, backgroundYield, backgroundSample
+  Common.NeatFitnessFunction(block, signalYield, signalSample, backgroundYield, backgroundSample)
+  return [chromo.fitness for chromo in block]
+
+
+# Evaluates a racing stage of the chromosomes still racing in blocks
+def RaceStageWrapper(genomes, stage, error):
+  blocks = zip(FitnessFunctionBlocks(genomes), [stage]*len(genomes), FitnessFunctionBlocks(error))
+  return numpy.concatenate(FitnessFunctionMap(RaceStageWorker, blocks) or [error])
+
+
+# Returns the errors of a block of chromosomes after a racing stage
+def RaceStageWorker(args):
+  global signalSample, backgroundSample
+  block, stage, error = args
+  return Common.NeatFitnessFunction.raceErrors(block, stage, error, signalSample, backgroundSample)
+
+
 import sys
 from optparse import OptionParser
 
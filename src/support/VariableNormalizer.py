@@ -12,6 +12,8 @@
 import copy, math
 import pickle
 
+import numpy
+
 import Common
 
 class VariableNormalizer:
@@ -47,6 +49,13 @@ class VariableNormalizer:
   ## Normalize a sample
   def normalizeSample(self, sample):
     self.__message('Normalizing variables in sample.')
+    # Arrays are normalized in place keeping their precision
+    if isinstance(sample, numpy.ndarray):
+      for i in xrange(1,len(self.__variables)):
+        ave, std = self(self.__variables[i])
+        sample[:,i] -= ave
+        sample[:,i] /= std
+      return
     for event in sample:
       self.normalize(event)
 
@@ -89,6 +98,25 @@ class VariableNormalizer:
     
     self.__message('Computing average and std for each variable in %d events.' % len(sample))    
 
+    # Arrays are added at once (in double precision)
+    if isinstance(sample, numpy.ndarray):
+      OldW = OldW or 0.
+      weights = numpy.asarray(sample[:,0], numpy.float64)
+      W = weights.sum()
+      for i in xrange(1, len(self.__variables)):
+        values = numpy.asarray(sample[:,i], numpy.float64)
+        A[variables[i]] = numpy.dot(weights, values)
+        B[variables[i]] = numpy.dot(weights, values**2)
+        if OldW:
+          A[variables[i]] += OldW*OldA[variables[i]]
+          B[variables[i]] += OldW*OldB[variables[i]]
+        A[variables[i]] = float(A[variables[i]]/(OldW + W))
+        B[variables[i]] = float(B[variables[i]]/(OldW + W))
+      self.__average = A
+      self.__sqaverage = B
+      self.__sumweight = float(OldW + W)
+      return
+
     # Computing weighted average iteractevily
     for event in sample:
       if not OldW: